@@ -22,6 +22,17 @@ Module for managing nested dictionary collections.
 # 0. You just DO WHAT THE FUCK YOU WANT TO.
 # ------------------------------------------------------------------------
 
+from array import array
+from collections.abc import Mapping
+import copy
+import copyreg
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class NestedDict(dict):
     """
     Class for managing nested dictionary structures. Normally, it works
@@ -41,7 +52,13 @@ class NestedDict(dict):
 
     If you want more sophisticated behavior than full access/prohibition,
     you can still use module level functions.
+
+    snapshot() makes copies sharing their subdictionaries, which get
+    copied only when they are about to be altered (see there).
     """
+    # token of the copy-on-write lineage, see snapshot()
+    _cow = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.lock = False
@@ -55,15 +72,154 @@ class NestedDict(dict):
         if isinstance(args[0], list):
             lock = self.get_lock(args[0])
             if not lock:
+                if self._cow is not None:
+                    self._unshare(args[0][:-1])
                 return setitem(self, args[0], args[1],
                                overwrite=not lock, restruct=not lock,
-                               dict_type=type(self))
+                               dict_type=self._node_factory())
             else:
                 return False
         else:
             super().__setitem__(*args)
             return True
 
+    def __delitem__(self, key):
+        """
+        Deletes the element on the path if key is a list. Warning! Unlike
+        __setitem__, it does not care about locks.
+        """
+        if isinstance(key, list):
+            if self._cow is not None:
+                self._unshare(key[:-1])
+            delitem(self, key)
+        else:
+            super().__delitem__(key)
+
+    def _node_type(self):
+        """Returns the type of the subdictionaries self creates."""
+        return type(self)
+
+    def _node_factory(self):
+        """
+        Returns the callable creating the subdictionaries of self, which
+        marks them as owned by self if self is a snapshot.
+        """
+        node_type = self._node_type()
+        token = self._cow
+        if token is None or not issubclass(node_type, NestedDict):
+            return node_type
+        def factory(*args, **kwargs):
+            node = node_type(*args, **kwargs)
+            node._cow = token
+            return node
+        return factory
+
+    @classmethod
+    def from_items(cls, items, dict_type=None):
+        """
+        Returns a new instance built from an iterable of (path, value)
+        pairs. The result is the same as of
+
+        >>> d = NestedDict()
+        >>> for path, value in items:
+        ...     d[path] = value
+
+        but faster: as the new tree has no locks, there is nothing to
+        check, and the subdictionaries on the path of the previous item are
+        kept, so walking starts where the paths diverge instead of the
+        root. Sorted input shares the most prefixes. items is consumed
+        lazily, so it can be a generator.
+
+        The subdictionaries are created by dict_type, the default is the
+        type of subdictionaries of the new instance.
+        """
+        result = cls()
+        if dict_type is None:
+            dict_type = result._node_factory()
+        keys = list()
+        # nodes[i] is the subdictionary on keys[:i]
+        nodes = [result]
+        for path, value in items:
+            _validate_path(path)
+            last = len(path) - 1
+            n = 0
+            limit = min(last, len(keys))
+            while n < limit and keys[n] == path[n]:
+                n += 1
+            del keys[n:]
+            del nodes[n + 1:]
+            node = nodes[-1]
+            for i in range(n, last):
+                key = path[i]
+                one_step = node.get(key)
+                if not isinstance(one_step, dict):
+                    one_step = dict_type()
+                    node[key] = one_step
+                node = one_step
+                keys.append(key)
+                nodes.append(node)
+            node[path[last]] = value
+        return result
+
+    def snapshot(self):
+        """
+        Returns a copy of self which shares all the subdictionaries with
+        self. It costs as much as copying the first level of self.
+
+        Afterwards self and the copy are copy-on-write: altering a path
+        through __setitem__, __delitem__ or merge() of either of them
+        copies the shared subdictionaries on that path only. Warning!
+        Altering a shared subdictionary directly (e.g. d['a']['b'] = 1)
+        affects both.
+        """
+        self._cow = object()
+        result = copy.copy(self)
+        result._cow = object()
+        return result
+
+    def _own(self, node):
+        """
+        Returns node if self owns it, otherwise a shallow copy of it which
+        self owns (plain dictionaries can not be marked, so they are
+        copied each time).
+        """
+        if getattr(node, '_cow', None) is self._cow:
+            return node
+        result = copy.copy(node)
+        if isinstance(result, NestedDict):
+            result._cow = self._cow
+        return result
+
+    def _unshare(self, path):
+        """
+        Replaces the shared subdictionaries on path with copies owned by
+        self as far as path can be walked.
+        """
+        node = self
+        for key in path:
+            try:
+                child = dict.__getitem__(node, key)
+            except (KeyError, TypeError):
+                return
+            if not isinstance(child, dict):
+                return
+            owned = self._own(child)
+            if owned is not child:
+                dict.__setitem__(node, key, owned)
+            node = owned
+
+    def _unshare_all(self):
+        """Replaces all the shared subdictionaries with owned copies."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if isinstance(child, dict):
+                    owned = self._own(child)
+                    if owned is not child:
+                        dict.__setitem__(node, key, owned)
+                    stack.append(owned)
+
     def get_lock(self, path):
         """
         Returns the state of lock on the given path. In fact it walks on
@@ -71,13 +227,13 @@ class NestedDict(dict):
         lock it can get. 
         """
         lock = self.lock
-        level = 1
-        while level <= len(path):
+        node = self
+        for key in path:
             try:
-                lock = getitem(self, path[:level]).lock
+                node = node[key]
+                lock = node.lock
             except (KeyError, AttributeError):
                 break
-            level += 1
         return lock
 
     def func_if_unlocked(self, *args):
@@ -95,8 +251,10 @@ class NestedDict(dict):
         """
         self.lock = True
         if recursively:
-            for p in self.paths(of_values=False):
-                self.__getitem__(p).lock = True
+            if self._cow is not None:
+                self._unshare_all()
+            for subdict in _subdicts(self):
+                subdict.lock = True
 
     def lock_open(self, recursively=True):
         """
@@ -104,8 +262,10 @@ class NestedDict(dict):
         """
         self.lock = False
         if recursively:
-            for p in self.paths(of_values=False):
-                self.__getitem__(p).lock = False
+            if self._cow is not None:
+                self._unshare_all()
+            for subdict in _subdicts(self):
+                subdict.lock = False
 
     def merge(self, *dictobjs, restruct=True):
         """
@@ -117,24 +277,419 @@ class NestedDict(dict):
               func_if_extend=self.func_if_unlocked,
               func_if_overwrite=self.func_if_unlocked,
               restruct=restruct,
-              dict_type=type(self))
+              dict_type=self._node_factory())
 
-    def paths(self, of_values=True):
+    def paths(self, of_values=True, **kwargs):
         """
         Same as module level function paths.
         """
-        return paths(self, of_values=of_values)
+        return paths(self, of_values=of_values, **kwargs)
+
+def _touching(method):
+    """
+    Returns a version of a method altering a dictionary in place, which
+    marks the index of the IndexedNestedDict of the dictionary stale.
+    """
+    def touching(self, *args, **kwargs):
+        self._touch()
+        return method(self, *args, **kwargs)
+    touching.__name__ = method.__name__
+    touching.__doc__ = method.__doc__
+    return touching
+
+class _IndexedNode(NestedDict):
+    """
+    Subdictionary of an IndexedNestedDict (its root), which marks the
+    index of the root stale when it gets altered.
+    """
+    _root = None
+
+    def _touch(self):
+        if self._root is not None:
+            self._root._stale = True
+
+    __setitem__ = _touching(NestedDict.__setitem__)
+    __delitem__ = _touching(NestedDict.__delitem__)
+    clear = _touching(dict.clear)
+    pop = _touching(dict.pop)
+    popitem = _touching(dict.popitem)
+    setdefault = _touching(dict.setdefault)
+    update = _touching(dict.update)
+    __ior__ = _touching(dict.__ior__)
+
+    def __copy__(self):
+        # copy.copy() would set the items one by one
+        result = type(self).__new__(type(self))
+        dict.update(result, self)
+        result.__dict__.update(self.__dict__)
+        return result
+
+    def _node_factory(self):
+        return _indexed_node_factory(super()._node_factory(), self._root)
+
+def _indexed_node_factory(factory, root):
+    """Returns factory extended by binding the new nodes to root."""
+    def indexed_factory(*args, **kwargs):
+        node = factory(*args, **kwargs)
+        node._root = root
+        return node
+    return indexed_factory
+
+class IndexedNestedDict(NestedDict):
+    """
+    NestedDict which maintains a flat index alongside the tree: a
+    dictionary where keys are the tuples of the paths of values and values
+    are the values on them. Reading a value on a list path becomes a
+    single hash lookup, but the index costs memory, so it is opt-in.
+
+    The index is kept up to date by __setitem__, __delitem__ and merge()
+    of the IndexedNestedDict. Its subdictionaries report any other
+    alteration (e.g. d[['a']]['b'] = 1, or module level merge()), which
+    makes the index rebuilt on next use. Dictionaries set as values (and
+    the ones passed to __init__) are not watched, so if you alter them
+    directly, call reindex() afterwards.
+
+    The index property is meant to be used for bulk export too.
+    """
+    _stale = False
+    # True while NestedDict methods set or delete items of the first level
+    # through __setitem__ or __delitem__
+    _altering = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reindex()
+
+    def _touch(self):
+        self._stale = True
+
+    clear = _touching(dict.clear)
+    pop = _touching(dict.pop)
+    popitem = _touching(dict.popitem)
+    setdefault = _touching(dict.setdefault)
+    update = _touching(dict.update)
+    __ior__ = _touching(dict.__ior__)
+
+    @property
+    def index(self):
+        if self._stale:
+            self.reindex()
+        return self._index
+
+    def __getitem__(self, *args):
+        if isinstance(args[0], list):
+            try:
+                return self.index[tuple(args[0])]
+            except KeyError:
+                pass
+        return super().__getitem__(*args)
+
+    def __setitem__(self, *args):
+        if self._altering:
+            return super().__setitem__(*args)
+        if not isinstance(args[0], list) and isinstance(args[1], dict):
+            # e.g. module level merge() fills it afterwards
+            self._stale = True
+            return super().__setitem__(*args)
+        path = args[0] if isinstance(args[0], list) else [args[0]]
+        old = self._indexed(path)
+        result = self._alter(super().__setitem__, *args)
+        if result:
+            self._unindex(path, old)
+            value = getitem(self, path)
+            if isinstance(value, dict):
+                for p in paths(value):
+                    self._index[tuple(path) + tuple(p)] = getitem(value, p)
+            else:
+                self._index[tuple(path)] = value
+        return result
+
+    def __delitem__(self, key):
+        if self._altering:
+            return super().__delitem__(key)
+        path = key if isinstance(key, list) else [key]
+        old = self._indexed(path)
+        self._alter(super().__delitem__, key)
+        self._unindex(path, old)
+
+    def _alter(self, method, *args):
+        """
+        Calls method, which alters the tree on behalf of self, so it
+        neither makes the index stale, nor gets indexed again.
+        """
+        stale = self._stale
+        self._altering = True
+        try:
+            return method(*args)
+        finally:
+            self._altering = False
+            self._stale = stale
+
+    def __copy__(self):
+        # the copy must not share the index
+        result = type(self).__new__(type(self))
+        dict.update(result, self)
+        result.__dict__.update(self.__dict__)
+        result._index = dict(self._index)
+        return result
+
+    def __reduce__(self):
+        # pickle would set the items through __setitem__ before the
+        # attributes are restored, so they go to __setstate__ together
+        attributes = self.__dict__.copy()
+        attributes.pop('_index', None)
+        return (copyreg.__newobj__, (type(self),), (dict(self), attributes))
+
+    def __setstate__(self, state):
+        items, attributes = state
+        dict.update(self, items)
+        self.__dict__.update(attributes)
+        self.reindex()
+
+    def _node_type(self):
+        return _IndexedNode
+
+    def _node_factory(self):
+        return _indexed_node_factory(super()._node_factory(), self)
+
+    def _own(self, node):
+        result = super()._own(node)
+        if result is not node and isinstance(result, _IndexedNode):
+            result._root = self
+        return result
+
+    def _indexed(self, path):
+        """Returns the list of index keys on and under path."""
+        try:
+            value = getitem(self, path)
+        except (KeyError, TypeError):
+            return []
+        if isinstance(value, dict):
+            return [tuple(path) + tuple(p) for p in paths(value)]
+        return [tuple(path)]
+
+    def _unindex(self, path, old):
+        """
+        Removes the old index keys and the keys of values which may have
+        been cleared on the way to path by restructuring.
+        """
+        if self._stale:
+            return
+        for key in old:
+            del self._index[key]
+        for level in range(1, len(path)):
+            self._index.pop(tuple(path[:level]), None)
+
+    def merge(self, *dictobjs, restruct=True):
+        super().merge(*dictobjs, restruct=restruct)
+        self.reindex()
+
+    @classmethod
+    def from_items(cls, items, dict_type=None):
+        result = super().from_items(items, dict_type=dict_type)
+        result.reindex()
+        return result
+
+    def reindex(self):
+        """Rebuilds the index from the tree."""
+        self._index = {p: getitem(self, p) for p in paths(self,
+                                                          as_tuples=True)}
+        self._stale = False
+
+class FrozenNestedDict(dict):
+    """
+    Compact read-only dictionary type for nested dictionary structures.
+    Like NestedDict, it accepts lists as paths for getting items, but it
+    can not be altered and it has no per instance attributes (no lock
+    either, it is always locked), so its nodes take only the memory of
+    the builtin dictionary. Create it with retype():
+
+    >>> tree = retype(nesteddict, FrozenNestedDict)
+    """
+    __slots__ = ()
+    lock = True
+
+    def __getitem__(self, *args):
+        if isinstance(args[0], list):
+            return getitem(self, args[0])
+        return super().__getitem__(*args)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, super().__repr__())
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('{} is read-only'.format(type(self).__name__))
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return retype(self, type(self), copy_values=True)
+
+class NestedChainMap(Mapping):
+    """
+    Read-only view of layers of nested dictionaries, like
+    collections.ChainMap for nested trees. The first layer has the highest
+    priority, so instead of merging defaults, site config and overrides
+    you can use
+
+    >>> config = NestedChainMap(overrides, site_config, defaults)
+
+    Lookups (list paths work like for NestedDict) are resolved through
+    the layers on each access, without copying anything: a value is taken
+    from the first layer which has it, and a subdictionary is returned as
+    a NestedChainMap of the subdictionaries of the layers on that path.
+    The result is the same as what
+
+    >>> merge(defaults, site_config, overrides, return_new=True)
+
+    would contain, but reading costs O(layers x depth) and assembling the
+    view costs nothing. Use materialize() to get a real NestedDict.
+    """
+    def __init__(self, *layers):
+        self.layers = list(layers)
+        # tells if the last layer is the base of the merge, so its empty
+        # subdictionaries count
+        self._base = True
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join(repr(l) for l in self.layers))
+
+    def __getitem__(self, key):
+        if isinstance(key, list):
+            _validate_path(key)
+            result = self
+            for k in key:
+                if not isinstance(result, NestedChainMap):
+                    raise KeyError(k)
+                result = result._child(k)
+            return result
+        return self._child(key)
+
+    def __iter__(self):
+        seen = set()
+        for layer in reversed(self.layers):
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    try:
+                        self._child(key)
+                    except KeyError:
+                        continue
+                    yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def _child(self, key):
+        """
+        Returns the value of the first layer having key, or the view of
+        the subdictionaries of the layers on key up to the first layer
+        having a value there.
+        """
+        subdicts = list()
+        base = False
+        last = len(self.layers) - 1
+        for i, layer in enumerate(self.layers):
+            try:
+                value = layer[key]
+            except KeyError:
+                continue
+            is_base = self._base and i == last
+            if isinstance(value, dict):
+                # merge() ignores subdictionaries without values, except
+                # for the ones of its first argument
+                if is_base or _has_values(value):
+                    subdicts.append(value)
+                    base = is_base
+            elif subdicts:
+                break
+            else:
+                return value
+        if not subdicts:
+            raise KeyError(key)
+        result = type(self)(*subdicts)
+        result._base = base
+        return result
+
+    def new_child(self, layer=None):
+        """
+        Returns a new view with layer (an empty dictionary by default) in
+        front of the layers of self.
+        """
+        result = type(self)(dict() if layer is None else layer,
+                            *self.layers)
+        result._base = self._base
+        return result
+
+    def paths(self, of_values=True, as_tuples=False):
+        """
+        Same as module level function paths, for the merged tree.
+        """
+        out = tuple if as_tuples else list
+        path = list()
+        stack = [(self, iter(self))]
+        while stack:
+            view, keys = stack[-1]
+            try:
+                key = next(keys)
+            except StopIteration:
+                stack.pop()
+                if stack:
+                    path.pop()
+                continue
+            value = view._child(key)
+            path.append(key)
+            if isinstance(value, NestedChainMap):
+                if of_values is False:
+                    yield out(path)
+                stack.append((value, iter(value)))
+            else:
+                if of_values is True:
+                    yield out(path)
+                path.pop()
+
+    def materialize(self, dict_type=NestedDict):
+        """
+        Returns the merged tree as a new dict_type dictionary. Values are
+        not copied.
+        """
+        result = dict_type()
+        stack = [(self, result)]
+        while stack:
+            view, node = stack.pop()
+            for key in view:
+                value = view._child(key)
+                if isinstance(value, NestedChainMap):
+                    node[key] = dict_type()
+                    stack.append((value, node[key]))
+                else:
+                    node[key] = value
+        return result
+
+def _has_values(dictobj):
+    """Returns True if there is a value in dictobj at any depth."""
+    for p in paths(dictobj, reuse=True):
+        return True
+    return False
 
 def getitem(dictobj, path):
     """
     Returns the element of a nested dictionary structure which is on the
-    given path. 
+    given path (a list or a tuple of keys).
     """
     _validate_path(path)
-    if len(path) == 1:
-        return dictobj[path[0]]
-    else:
-        return getitem(dictobj[path[0]], path[1:])
+    for key in path:
+        dictobj = dictobj[key]
+    return dictobj
 
 def setitem(dictobj, path, value, overwrite=True, restruct=True,
         dict_type=dict):
@@ -150,52 +705,104 @@ def setitem(dictobj, path, value, overwrite=True, restruct=True,
     cleared by an empty dictionary to make way forward.
     """
     _validate_path(path)
+    last = len(path) - 1
 
-    try:
-        one_step = dictobj[path[0]]
-    except KeyError:
-        if len(path) == 1:
-            dictobj[path[0]] = value
-            return True
-        else:
-            dictobj[path[0]] = dict_type()
-            one_step = dictobj[path[0]]
-    else:
-        if len(path) == 1 and one_step == value:
-            return None
-        elif len(path) == 1 and overwrite is False:
-            return False
-        elif len(path) == 1 and overwrite is True:
-            dictobj[path[0]] = value
-            return True
+    for i, key in enumerate(path):
+        try:
+            one_step = dictobj[key]
+        except KeyError:
+            if i == last:
+                dictobj[key] = value
+                return True
+            else:
+                dictobj[key] = dict_type()
+                one_step = dictobj[key]
         else:
-            if not isinstance(one_step, dict):
+            if i == last and one_step == value:
+                return None
+            elif i == last and overwrite is False:
+                return False
+            elif i == last and overwrite is True:
+                dictobj[key] = value
+                return True
+            elif not isinstance(one_step, dict):
                 if overwrite is True and restruct is True: ##TEST
-                    dictobj[path[0]] = dict_type()
-                    one_step = dictobj[path[0]]
+                    dictobj[key] = dict_type()
+                    one_step = dictobj[key]
                 else:
                     return False
-    return setitem(one_step, path[1:], value, overwrite=overwrite,
-                restruct=restruct, dict_type=dict_type)
+            elif i == last:
+                # there is no key left to walk on
+                _validate_path([])
+        dictobj = one_step
+
+def delitem(dictobj, path):
+    """
+    Deletes the element of a nested dictionary structure which is on the
+    given path (a list or a tuple of keys).
+    """
+    _validate_path(path)
+    for key in path[:-1]:
+        dictobj = dictobj[key]
+    del dictobj[path[-1]]
 
-def paths(dictobj, of_values=True, past_keys=[]):
+def paths(dictobj, of_values=True, past_keys=[], as_tuples=False,
+          reuse=False, max_depth=None, key_filter=None):
     """
     Generator to iterate through branches. Used by merge function, but
     can be useful for other object management stuffs.
 
     By default it returns paths of values. However, if of_values=False
     then it returns the paths of all subdirectories.
+
+    Paths are lists of keys (prefixed by past_keys), or tuples if
+    as_tuples=True. If reuse=True, the very same list gets yielded each
+    time, altered in place. This is the fastest, but unsafe: a yielded
+    path is valid only until the next one is generated, so copy it if you
+    keep it.
+
+    Walking can be pruned: paths longer than max_depth are not walked,
+    and if key_filter is given, it is called with each path (of values or
+    subdirectories, in the same form as yielded) and the path with all of
+    its subpaths gets skipped if it returns False.
+
+    The tree is walked with an explicit stack, so depth is not limited by
+    the recursion limit.
     """
-    for key in dictobj.keys():
-        path = past_keys + [key]
-        if not isinstance(dictobj[key], dict):
+    if reuse:
+        out = lambda p: p
+    elif as_tuples:
+        out = tuple
+    else:
+        out = list
+
+    path = list(past_keys)
+    stack = [iter(dictobj.items())]
+    while stack:
+        try:
+            key, value = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            if stack:
+                path.pop()
+            continue
+
+        path.append(key)
+        if key_filter is not None and not key_filter(out(path)):
+            path.pop()
+            continue
+
+        if not isinstance(value, dict):
             if of_values is True:
-                yield path
+                yield out(path)
+            path.pop()
         else:
             if of_values is False:
-                yield path
-            yield from paths(dictobj[key], of_values=of_values,
-                             past_keys=path)
+                yield out(path)
+            if max_depth is None or len(stack) < max_depth:
+                stack.append(iter(value.items()))
+            else:
+                path.pop()
 
 def merge(*dictobjs,
           func_if_extend=True,
@@ -222,6 +829,13 @@ def merge(*dictobjs,
     Moreover you can pass functions to the two mentioned arguments which
     will be called with the path (list of keys), dictobj1, dictobj2
     arguments and expected to return True or False.
+
+    The dictionaries are walked in lockstep: shared subdictionaries are
+    visited once and a missing subdictionary gets grafted in a single
+    assignment as a dict_type copy (values are not copied). Functions are
+    called in the order of paths(), but with a missing subdictionary
+    dictobj1 gets its accepted values only after all of its paths have
+    been decided.
     """
     if return_new is True:
         d = retype(dictobjs[0], dict_type)
@@ -229,49 +843,312 @@ def merge(*dictobjs,
         d = dictobjs[0]
 
     for dictobj in dictobjs[1:]:
-        for p in paths(dictobj):
-            try:
-                getitem(d, p)
-            except KeyError:
-                    if hasattr(func_if_extend, '__call__'):
-                        ex = func_if_extend(p, d, dictobj)
+        # The locks of NestedDict.merge() get resolved during the walk.
+        if _is_func_if_unlocked(func_if_extend, d) and (
+                           _is_func_if_unlocked(func_if_overwrite, d)):
+            lock = d.lock
+        else:
+            lock = None
+        # Snapshots get unshared only where they are altered.
+        if getattr(d, '_cow', None) is not None:
+            own = _Unsharer(d)
+        else:
+            own = None
+        _merge_nodes(d, dictobj, [], d, dictobj,
+                     func_if_extend, func_if_overwrite, restruct, dict_type,
+                     lock=lock, own=own)
+    return d
+
+class _Unsharer:
+    """
+    Callable which returns the subdictionary of a NestedDict snapshot on
+    key of its parent (an _Unsharer too, or the snapshot itself if parent
+    is None) unshared with the ancestors. Unsharing happens on the first
+    call only.
+    """
+    def __init__(self, root, parent=None, key=None, node=None):
+        self.root = root
+        self.parent = parent
+        self.key = key
+        self.node = root if parent is None else node
+        self.owned = None
+
+    def __call__(self):
+        if self.owned is None:
+            owned = self.root._own(self.node)
+            if owned is not self.node:
+                dict.__setitem__(self.parent(), self.key, owned)
+            self.owned = owned
+        return self.owned
+
+def _is_func_if_unlocked(func, d):
+    return (getattr(func, '__func__', None) is NestedDict.func_if_unlocked
+            and func.__self__ is d)
+
+def _merge_nodes(node, other, path, d, dictobj,
+                 func_if_extend, func_if_overwrite, restruct, dict_type,
+                 lock=None, walking=True, own=None):
+    """
+    Merges the other subdictionary of dictobj on path into node, which is
+    the subdictionary of d on the same path. path is altered in place
+    during the walk and restored by the end.
+
+    If lock is not None, the functions are d.func_if_unlocked() and lock
+    is the state d.get_lock() would return for path. Then the decisions
+    are made by following the locks during the walk instead of calling
+    the functions. walking becomes False when get_lock() would stop
+    walking at a node without lock.
+
+    If d is a snapshot, own is the _Unsharer of node, which gets called
+    before node is altered.
+    """
+    for key, value in other.items():
+        try:
+            current = node[key]
+        except KeyError:
+            if lock is not None:
+                ex = not lock
+            else:
+                ex = func_if_extend
+            path.append(key)
+            graft = _graft(value, path, d, dictobj, ex, dict_type)
+            path.pop()
+            if graft is not _MISSING:
+                if own is not None:
+                    node = own()
+                node[key] = graft
+            continue
+
+        if isinstance(value, dict):
+            if isinstance(current, dict):
+                if lock is None:
+                    sub_lock, sub_walking = None, walking
+                elif walking and hasattr(current, 'lock'):
+                    sub_lock, sub_walking = current.lock, True
+                else:
+                    sub_lock, sub_walking = lock, False
+                if own is not None:
+                    sub_own = _Unsharer(d, own, key, current)
+                else:
+                    sub_own = None
+                path.append(key)
+                _merge_nodes(current, value, path, d, dictobj,
+                             func_if_extend, func_if_overwrite, restruct,
+                             dict_type, lock=sub_lock, walking=sub_walking,
+                             own=sub_own)
+                path.pop()
+            else:
+                # a value blocks the path: clearing it is overwriting and
+                # restructuring, then its paths get extended
+                if lock is not None:
+                    ow = not lock
+                else:
+                    ow = _decide(func_if_overwrite, path + [key], d,
+                                 dictobj)
+                if not (ow and restruct):
+                    continue
+                for sub_p in paths(value, past_keys=[key]):
+                    if lock is not None:
+                        ex = not lock
                     else:
-                        ex = func_if_extend
+                        ex = _decide(func_if_extend, path + sub_p, d,
+                                     dictobj)
                     if ex:
-                        setitem(d, p, getitem(dictobj, p),
+                        if own is not None:
+                            node = own()
+                        setitem(node, sub_p, getitem(value, sub_p[1:]),
+                                overwrite=ow,
+                                restruct=restruct and ow,
                                 dict_type=dict_type)
+        elif current != value:
+            if lock is None:
+                ow = _decide(func_if_overwrite, path + [key], d, dictobj)
+            elif walking and isinstance(current, dict) and hasattr(
+                                                          current, 'lock'):
+                ow = not current.lock
             else:
-                if getitem(d, p) != getitem(dictobj, p):
-                    if hasattr(func_if_overwrite, '__call__'):
-                        ow = func_if_overwrite(p, d, dictobj)
-                    else:
-                        ow = func_if_overwrite
-                    restruct_ = restruct and ow 
-                    setitem(d, p, getitem(dictobj, p),
-                            overwrite=ow,
-                            restruct=restruct_,
-                            dict_type=dict_type)
-    return d
+                ow = not lock
+            if ow and own is not None:
+                node = own()
+            setitem(node, [key], value,
+                    overwrite=ow,
+                    restruct=restruct and ow,
+                    dict_type=dict_type)
+
+def _graft(value, path, d, dictobj, func_if_extend, dict_type):
+    """
+    Returns what merging value to the missing path results in: value
+    itself, a dict_type copy of a subdictionary with its accepted values
+    only or _MISSING if nothing has been accepted. path is altered in
+    place during the walk and restored by the end.
+    """
+    if not hasattr(func_if_extend, '__call__') and not func_if_extend:
+        return _MISSING
 
-def retype(dictobj, dict_type):
+    if not isinstance(value, dict):
+        if _decide(func_if_extend, list(path), d, dictobj):
+            return value
+        return _MISSING
+
+    result = dict_type()
+    for key, sub_value in value.items():
+        path.append(key)
+        graft = _graft(sub_value, path, d, dictobj, func_if_extend,
+                       dict_type)
+        path.pop()
+        if graft is not _MISSING:
+            result[key] = graft
+    return result if result else _MISSING
+
+def _decide(func_or_bool, path, d, dictobj):
+    if hasattr(func_or_bool, '__call__'):
+        return func_or_bool(path, d, dictobj)
+    return func_or_bool
+
+def _subdicts(dictobj):
+    """Generator of all subdictionaries of dictobj at any depth."""
+    stack = [dictobj]
+    while stack:
+        for value in stack.pop().values():
+            if isinstance(value, dict):
+                yield value
+                stack.append(value)
+
+_MISSING = object()
+
+def retype(dictobj, dict_type, copy_values=False):
     """
     Recursively modifies the type of a dictionary object and returns a new
     dictionary of type dict_type. You can also use this function instead
     of copy.deepcopy() for dictionaries.
+
+    Values are shared with dictobj unless copy_values is True, when they
+    get deep copied (values referenced more than once stay shared in the
+    result as well, like with copy.deepcopy()).
+
+    Subdictionaries are created from their complete list of items, so
+    read-only types like FrozenNestedDict can be used as dict_type. The
+    walk is not recursive, dictobj can be of any depth.
     """
-    def walker(dictobj):
-        for k in dictobj.keys():
-            if isinstance(dictobj[k], dict):
-                yield (k, dict_type(walker(dictobj[k])))
-            else:
-                yield (k, dictobj[k])
-    d = dict_type(walker(dictobj))
-    return d
+    memo = dict()
+    # stack of (items iterator, collected items, key in parent)
+    stack = [(iter(dictobj.items()), [], None)]
+    while True:
+        items, collected, key = stack[-1]
+        append = collected.append
+        for k, v in items:
+            if isinstance(v, dict):
+                stack.append((iter(v.items()), [], k))
+                break
+            if copy_values:
+                v = copy.deepcopy(v, memo)
+            append((k, v))
+        else:
+            stack.pop()
+            d = dict_type(collected)
+            if not stack:
+                return d
+            stack[-1][1].append((key, d))
+
 
+def flatten(dictobjs, sep='/', schema=None, typecode=None,
+            use_numpy=False):
+    """
+    Turns nested dictionaries sharing a structure (e.g. sdf.File.get_dict()
+    results) into a table. Returns a dictionary of columns where keys are
+    the paths of values joined by sep, and columns contain the values on
+    those paths in the order of dictobjs, which can be any iterable.
+
+    schema is the list of paths to take. By default it is discovered from
+    the first dictionary, only once, so the rest of the dictionaries must
+    have all of its paths (KeyError otherwise) and their other values are
+    ignored.
+
+    Columns are lists, or array.array objects if typecode is given (a
+    typecode, or a dictionary of typecodes by column names). If
+    use_numpy=True and NumPy is available they are NumPy arrays with
+    typecode as dtype.
+    """
+    dictobjs = iter(dictobjs)
+    if schema is None:
+        first = next(dictobjs, None)
+        if first is None:
+            return dict()
+        schema = list(paths(first, as_tuples=True))
+        dictobjs = itertools.chain([first], dictobjs)
+    schema = [tuple(path) for path in schema]
+    columns = [list() for path in schema]
+    getters = list(zip(schema, (column.append for column in columns)))
+    for dictobj in dictobjs:
+        for path, append in getters:
+            value = dictobj
+            for key in path:
+                value = value[key]
+            append(value)
+
+    result = dict()
+    for path, column in zip(schema, columns):
+        name = sep.join(str(key) for key in path)
+        if isinstance(typecode, dict):
+            code = typecode.get(name)
+        else:
+            code = typecode
+        if use_numpy and numpy is not None:
+            column = numpy.array(column, dtype=code)
+        elif code is not None:
+            column = array(code, column)
+        result[name] = column
+    return result
+
+def unflatten(columns, sep='/', dict_type=dict):
+    """
+    Reverse of flatten(): returns the list of the dictionaries of the
+    rows of a dictionary of columns (lists, array.array objects or NumPy
+    arrays of the same length). Keys of the nested dictionaries are the
+    parts of column names split by sep.
+
+    The structure is worked out once, from the column names, and the
+    dictionaries are built along it.
+    """
+    # plan of building a row: (parent node, key, column index or None for
+    # a new node), nodes are indexed in order of creation
+    plan = list()
+    nodes = {(): 0}
+    values = set()
+    for i, name in enumerate(columns):
+        path = tuple(name.split(sep))
+        for level in range(1, len(path) + 1):
+            if path[:level] in values:
+                raise ValueError('column {!r} is under a value'.format(name))
+        for level in range(1, len(path)):
+            if path[:level] not in nodes:
+                nodes[path[:level]] = len(nodes)
+                plan.append((nodes[path[:level - 1]], path[level - 1], None))
+        if path in nodes:
+            raise ValueError('column {!r} is over values'.format(name))
+        values.add(path)
+        plan.append((nodes[path[:-1]], path[-1], i))
+
+    cols = [column.tolist() if hasattr(column, 'tolist') else column
+            for column in columns.values()]
+    if len(set(map(len, cols))) > 1:
+        raise ValueError('columns have to be of the same length')
+    result = list()
+    for row in zip(*cols):
+        built = [dict_type()]
+        for parent, key, i in plan:
+            if i is None:
+                node = dict_type()
+                built[parent][key] = node
+                built.append(node)
+            else:
+                built[parent][key] = row[i]
+        result.append(built[0])
+    return result
 
 def _validate_path(path):
-    if not isinstance(path, list):
-        raise TypeError('path argument have to be a list')
+    if not isinstance(path, (list, tuple)):
+        raise TypeError('path argument have to be a list or a tuple')
     if not path:
         raise Exception('path argument have to be a nonempty list')
 
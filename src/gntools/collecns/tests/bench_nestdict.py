@@ -0,0 +1,82 @@
+"""
+Benchmarks of nestdict functions. Run from the collecns directory:
+
+    python -m tests.bench_nestdict
+"""
+import copy
+import timeit
+
+import nestdict
+from tests.merge_by_paths import merge_by_paths
+
+def wide_tree(width=1000, depth=2):
+    """Returns a tree with width keys on each of the depth levels."""
+    if depth == 1:
+        return {'k{}'.format(i): i for i in range(width)}
+    return {'k{}'.format(i): wide_tree(width, depth - 1)
+            for i in range(width)}
+
+def deep_tree(depth=200, width=5):
+    """Returns a chain of depth dictionaries with width values on each."""
+    result = node = dict()
+    for level in range(depth):
+        for i in range(width):
+            node['v{}'.format(i)] = level
+        node['next'] = dict()
+        node = node['next']
+    return result
+
+def halves(tree):
+    """
+    Splits the values of tree into two trees which overlap on the half of
+    the values (with different values there).
+    """
+    part1, part2 = dict(), dict()
+    for i, p in enumerate(nestdict.paths(tree)):
+        value = nestdict.getitem(tree, p)
+        if i % 3 != 1:
+            nestdict.setitem(part1, p, value)
+        if i % 3 != 0:
+            nestdict.setitem(part2, p, value + 1)
+    return part1, part2
+
+def bench(name, func, number=3):
+    t = timeit.timeit(func, number=number)
+    print('{:<40}{:>10.4f} s'.format(name, t / number))
+
+def bench_merge():
+    for tree_name, tree in (('wide (100x100)', wide_tree(100, 2)),
+                            ('wide (30x30x30)', wide_tree(30, 3)),
+                            ('deep (200 levels)', deep_tree(200))):
+        part1, part2 = halves(tree)
+        for func in (merge_by_paths, nestdict.merge):
+            targets = [copy.deepcopy(part1) for i in range(3)]
+            bench('{} {}'.format(func.__name__, tree_name),
+                  lambda: func(targets.pop(), part2), number=3)
+
+def bench_locked_merge():
+    tree = nestdict.retype(wide_tree(30, 3), nestdict.NestedDict)
+    part1, part2 = halves(tree)
+    part1 = nestdict.retype(part1, nestdict.NestedDict)
+    part1.lock_close()
+    part1['k0'].lock_open()
+
+    def by_paths(target):
+        merge_by_paths(target, part2,
+                                 func_if_extend=target.func_if_unlocked,
+                                 func_if_overwrite=target.func_if_unlocked,
+                                 dict_type=nestdict.NestedDict)
+
+    targets = [copy.deepcopy(part1) for i in range(3)]
+    bench('merge_by_paths locked (30x30x30)',
+          lambda: by_paths(targets.pop()))
+    targets = [copy.deepcopy(part1) for i in range(3)]
+    bench('NestedDict.merge locked (30x30x30)',
+          lambda: targets.pop().merge(part2))
+
+def main():
+    bench_merge()
+    bench_locked_merge()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Reference implementation of nestdict.merge() for tests and benchmarks.
+"""
+from nestdict import getitem, paths, retype, setitem
+
+def merge_by_paths(*dictobjs,
+                   func_if_extend=True,
+                   func_if_overwrite=True,
+                   restruct=True,
+                   dict_type=dict,
+                   return_new=False):
+    """
+    The former implementation of nestdict.merge() which walks both
+    dictionaries from the root for each path. Tests and benchmarks compare
+    merge() with it.
+    """
+    if return_new is True:
+        d = retype(dictobjs[0], dict_type)
+    elif return_new is False:
+        d = dictobjs[0]
+
+    for dictobj in dictobjs[1:]:
+        for p in paths(dictobj):
+            try:
+                getitem(d, p)
+            except KeyError:
+                    if hasattr(func_if_extend, '__call__'):
+                        ex = func_if_extend(p, d, dictobj)
+                    else:
+                        ex = func_if_extend
+                    if ex:
+                        setitem(d, p, getitem(dictobj, p),
+                                dict_type=dict_type)
+            else:
+                if getitem(d, p) != getitem(dictobj, p):
+                    if hasattr(func_if_overwrite, '__call__'):
+                        ow = func_if_overwrite(p, d, dictobj)
+                    else:
+                        ow = func_if_overwrite
+                    restruct_ = restruct and ow 
+                    setitem(d, p, getitem(dictobj, p),
+                            overwrite=ow,
+                            restruct=restruct_,
+                            dict_type=dict_type)
+    return d
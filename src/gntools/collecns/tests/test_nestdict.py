@@ -1,8 +1,11 @@
 import copy
+import pickle
+import sys
 
 import pytest
 
 import nestdict
+from tests.merge_by_paths import merge_by_paths
 
 class Test635483:
     """
@@ -51,6 +54,36 @@ class Test635483:
         for subdirpath in nestdict.paths(retyped2, of_values=False):
             assert type(nestdict.getitem(retyped2, subdirpath)) == dict
 
+    def test_retype_values(self):
+        """
+        Test of retype function's copy_values argument, deep trees and
+        FrozenNestedDict.
+        """
+        d = {'a': [1], 'b': {'c': [2]}}
+        assert nestdict.retype(d, dict)['b']['c'] is d['b']['c']
+        copied = nestdict.retype(d, dict, copy_values=True)
+        assert copied == d
+        assert copied['b']['c'] is not d['b']['c']
+        deep = node = dict()
+        for i in range(sys.getrecursionlimit() + 100):
+            node[i] = dict()
+            node = node[i]
+        node['value'] = 1
+        p, = nestdict.paths(nestdict.retype(deep, dict))
+        assert nestdict.getitem(deep, p) == 1
+        frozen = nestdict.retype(self.expected, nestdict.FrozenNestedDict)
+        assert frozen == self.expected
+        for subdirpath in nestdict.paths(frozen, of_values=False):
+            assert type(frozen[subdirpath]) == nestdict.FrozenNestedDict
+        assert frozen[['new york', 'queens county', 'plumbers']] == 9
+        assert not hasattr(frozen, '__dict__')
+        for alter in (lambda: frozen.__setitem__('a', 1),
+                      lambda: frozen['new york'].pop('queens county'),
+                      lambda: frozen.update(a=1)):
+            with pytest.raises(TypeError):
+                alter()
+        assert frozen == self.expected
+
     def test_NestedDict(self):
         """
         Test of NestedDict class.        
@@ -133,6 +166,55 @@ class Test635483:
         expected['new jersey']['mercer county']['plumbers'] = 10
         assert part1 == expected
 
+    def test_NestedDict_merge_locked(self):
+        """
+        Test if NestedDict's merge method resolving locks during the walk
+        works the same as calling func_if_unlocked for each path.
+        """
+        part1, part2 = self.get_parts()
+        part1.lock_close()
+        part1['new jersey'].lock_open(recursively=False)
+        part1[['new jersey', 'mercer county']].lock_open()
+        part2[['new jersey', 'new county', 'plumbers']] = 1
+        part2[['new york', 'new county', 'plumbers']] = 1
+        expected = copy.deepcopy(part1)
+        merge_by_paths(expected, part2,
+                                 func_if_extend=expected.func_if_unlocked,
+                                 func_if_overwrite=expected.func_if_unlocked,
+                                 dict_type=nestdict.NestedDict)
+        part1.merge(part2)
+        assert part1 == expected
+        assert 'new county' in part1['new jersey']
+        assert 'new county' not in part1['new york']
+        assert 'programmers' in part1['new jersey']['mercer county']
+        assert 'salesmen' not in part1['new jersey']['middlesex county']
+
+    def test_NestedDict_snapshot(self):
+        """
+        Test of NestedDict class' snapshot method.
+        """
+        nesteddict = self.test_NestedDict()
+        snapshot = nesteddict.snapshot()
+        assert snapshot == self.expected
+        assert snapshot['new york'] is nesteddict['new york']
+        # Only the subdictionaries on the altered path get copied
+        snapshot[['new jersey', 'mercer county', 'plumbers']] = 4
+        assert nesteddict == self.expected
+        assert snapshot[['new jersey', 'mercer county', 'plumbers']] == 4
+        assert snapshot['new york'] is nesteddict['new york']
+        assert (snapshot['new jersey']['middlesex county']
+                is nesteddict['new jersey']['middlesex county'])
+        # Both sides are copy-on-write
+        del nesteddict[['new york', 'queens county']]
+        assert snapshot['new york'] == self.expected['new york']
+        part1, part2 = self.get_parts()
+        snapshot = part1.snapshot()
+        snapshot.merge(part2)
+        assert snapshot == self.expected
+        assert part1 != self.expected
+        snapshot.lock_close()
+        assert part1[['new jersey', 'mercer county']].lock == False
+
     def test_close_open_lock(self):
         """
         Test of NestedDict class' lock and unlock methods.
@@ -155,6 +237,159 @@ class Test635483:
                                                      ['test'], 1) == True
         
 
+    def test_NestedDict_delitem__(self):
+        """
+        Test of NestedDict class' __delitem__ method and delitem function.
+        """
+        nesteddict = self.test_NestedDict()
+        del nesteddict[['new jersey', 'mercer county', 'plumbers']]
+        del nesteddict['new york']
+        nestdict.delitem(nesteddict, ('new jersey', 'middlesex county'))
+        assert nesteddict == {'new jersey':
+                                 {'mercer county': {'programmers': 81}}}
+        with pytest.raises(KeyError):
+            del nesteddict[['new jersey', 'fake']]
+
+    def test_IndexedNestedDict(self):
+        """
+        Test if IndexedNestedDict's index stays consistent with its tree.
+        """
+        def check(indexed):
+            expected = {tuple(p): nestdict.getitem(indexed, p)
+                        for p in indexed.paths()}
+            assert indexed.index == expected
+
+        indexed = nestdict.IndexedNestedDict()
+        for d in self.d:
+            indexed[d[0]] = d[1]
+        assert indexed == self.expected
+        check(indexed)
+        for d in self.d:
+            assert indexed[d[0]] == d[1]
+        for subdirpath in nestdict.paths(indexed, of_values=False):
+            assert isinstance(indexed[subdirpath], nestdict.NestedDict)
+        # restructuring a value and replacing a subdictionary
+        indexed[['new jersey', 'mercer county', 'plumbers', 'x']] = 1
+        check(indexed)
+        indexed[['new jersey', 'middlesex county']] = 5
+        check(indexed)
+        indexed['new york'] = {'kings county': {'plumbers': 2}}
+        check(indexed)
+        assert indexed[['new york', 'kings county', 'plumbers']] == 2
+        # locked paths are not changed
+        indexed[['new jersey']].lock = True
+        assert indexed.__setitem__(['new jersey', 'x'], 1) == False
+        check(indexed)
+        del indexed[['new jersey', 'mercer county']]
+        check(indexed)
+        del indexed['new york']
+        check(indexed)
+        part1, part2 = self.get_parts()
+        indexed = nestdict.IndexedNestedDict(part1)
+        check(indexed)
+        indexed.merge(part2)
+        assert indexed == self.expected
+        check(indexed)
+        indexed[['new york']] = 1
+        check(indexed)
+
+    def test_IndexedNestedDict_first_level(self):
+        """
+        Test if replacing and deleting items of the first level of an
+        IndexedNestedDict keeps its index consistent.
+        """
+        indexed = nestdict.IndexedNestedDict()
+        indexed[['a', 'b']] = 1
+        indexed[['a']] = {'c': 2}
+        assert indexed.index == {('a', 'c'): 2}
+        indexed[['a', 'c', 'd']] = 3
+        indexed['a'] = 4
+        assert indexed.index == {('a',): 4}
+        indexed[['b', 'c']] = 5
+        del indexed[['b']]
+        assert indexed.index == {('a',): 4}
+        assert indexed == {'a': 4}
+
+    def test_IndexedNestedDict_copy(self):
+        """
+        Test if copies of an IndexedNestedDict have their own index.
+        """
+        indexed = nestdict.IndexedNestedDict.from_items(self.d)
+        for copied in (copy.copy(indexed), copy.deepcopy(indexed),
+                       indexed.snapshot()):
+            copied[['x']] = 5
+            assert copied[['x']] == 5
+            assert 'x' not in indexed
+            with pytest.raises(KeyError):
+                indexed[['x']]
+            assert indexed.index == {tuple(d[0]): d[1] for d in self.d}
+
+    def test_IndexedNestedDict_pickle(self):
+        """
+        Test if unpickled IndexedNestedDicts have their tree, attributes
+        and index, and their subdictionaries report to them.
+        """
+        indexed = nestdict.IndexedNestedDict.from_items(self.d)
+        indexed[['texas']] = 1
+        indexed.lock = {'texas': True}
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            loaded = pickle.loads(pickle.dumps(indexed, protocol))
+            assert type(loaded) == nestdict.IndexedNestedDict
+            assert loaded == indexed
+            assert loaded.lock == indexed.lock
+            assert loaded.index == indexed.index
+            loaded[['new york']]['bronx county'] = 2
+            assert loaded[['new york', 'bronx county']] == 2
+            assert ('new york', 'bronx county') not in indexed.index
+
+    def test_IndexedNestedDict_subdict_writes(self):
+        """
+        Test if alterations through subdictionaries and module level
+        functions make the index rebuilt.
+        """
+        indexed = nestdict.IndexedNestedDict.from_items(self.d)
+        indexed[['new york']][['queens county', 'plumbers']] = 10
+        assert indexed[['new york', 'queens county', 'plumbers']] == 10
+        indexed[['new jersey', 'mercer county']]['plumbers'] = 11
+        assert indexed[['new jersey', 'mercer county', 'plumbers']] == 11
+        del indexed[['new jersey']]['middlesex county']
+        with pytest.raises(KeyError):
+            indexed[['new jersey', 'middlesex county', 'salesmen']]
+        nestdict.merge(indexed, {'new york': {'queens county':
+                                                  {'salesmen': 12}}})
+        assert indexed[['new york', 'queens county', 'salesmen']] == 12
+        indexed.update({'texas': 1})
+        assert indexed[['texas']] == 1
+        assert indexed.index == {tuple(p): nestdict.getitem(indexed, p)
+                                 for p in indexed.paths()}
+
+    def test_NestedDict_from_items(self):
+        """
+        Test if NestedDict.from_items builds the same as setting the items
+        one by one.
+        """
+        items = self.d + [(['new york', 'queens county'], 1),
+                          (['new york', 'queens county', 'plumbers'], 2),
+                          (['new jersey'], {'essex county': {}}),
+                          (['new jersey', 'essex county', 'salesmen'], 3),
+                          (('new jersey', 'hudson county'), 4)]
+        for cls in (nestdict.NestedDict, nestdict.IndexedNestedDict):
+            for inp in (self.d, sorted(self.d, reverse=True), items):
+                expected = cls()
+                for d in inp:
+                    expected[list(d[0])] = d[1]
+                built = cls.from_items(d for d in inp)
+                assert type(built) == cls
+                assert built == expected
+                for subdirpath in nestdict.paths(built, of_values=False):
+                    assert (type(built[subdirpath])
+                            == type(expected[subdirpath]))
+                if cls is nestdict.IndexedNestedDict:
+                    assert built.index == expected.index
+        assert nestdict.NestedDict.from_items(self.d) == self.expected
+        built = nestdict.NestedDict.from_items(self.d, dict_type=dict)
+        assert type(built['new york']) == dict
+
     def test_main(self):
         """
         Test of main() function.
@@ -248,12 +483,48 @@ class Test9730648:
             print('Calculated subdir paths:\n{}'.format(calculated))
             assert sorted(self.defaults_paths_d) == calculated
 
+    def test_paths_options(self):
+        """
+        Test of nestdict.paths generator function's options.
+        """
+        for e in self.checklist:
+            assert sorted(nestdict.paths(e[0], as_tuples=True)
+                          ) == sorted(tuple(p) for p in e[1])
+            assert sorted(list(p) for p in nestdict.paths(e[0], reuse=True)
+                          ) == sorted(e[1])
+        assert list(nestdict.paths(self.defaults, max_depth=1)) == [['svn']]
+        assert list(nestdict.paths(self.defaults, of_values=False,
+                                   max_depth=1)) == [['notify']]
+        assert sorted(nestdict.paths(self.defaults, max_depth=2)
+                      ) == sorted(p for p in self.defaults_paths_v
+                                  if len(p) <= 2)
+        assert sorted(nestdict.paths(self.defaults,
+                                     key_filter=lambda p: p[-1] != 'notifo')
+                      ) == sorted(p for p in self.defaults_paths_v
+                                  if 'notifo' not in p)
+        assert list(nestdict.paths({'a': {'b': 1}}, past_keys=['x'])
+                    ) == [['x', 'a', 'b']]
+
+    def test_paths_deep(self):
+        """
+        Test if nestdict.paths works on trees deeper than the recursion
+        limit.
+        """
+        d = node = dict()
+        for i in range(sys.getrecursionlimit() + 100):
+            node[i] = dict()
+            node = node[i]
+        node['value'] = 1
+        p, = nestdict.paths(d)
+        assert len(p) == sys.getrecursionlimit() + 101
+        assert nestdict.getitem(d, p) == 1
+
     def test_invalid_paths(self):
         """
         Test if nestdict.get and nestdict.set raises exception for nonlist
         or nonempty paths.
         """
-        bad_attr = ['svn', True, 0, None, (1, 2, 3),]
+        bad_attr = ['svn', True, 0, None, {1, 2, 3},]
         for a in bad_attr:
             with pytest.raises(TypeError):
                 nestdict.getitem(self.local_expected, a)
@@ -263,6 +534,21 @@ class Test9730648:
             nestdict.getitem(self.local_expected, [])
         with pytest.raises(Exception):
             nestdict.setitem(self.local_expected, [], True)
+        with pytest.raises(Exception):
+            nestdict.getitem(self.local_expected, ())
+
+    def test_tuple_paths(self):
+        """
+        Test if nestdict.getitem and nestdict.setitem accept tuples.
+        """
+        d = copy.deepcopy(self.local_expected)
+        for i, path in enumerate(self.defaults_paths_v):
+            assert nestdict.getitem(d, tuple(path)
+                                 ) == self.local_expected_vals[i]
+        assert nestdict.setitem(d, ('notify', 'notifo', 'secret'), "1234"
+                             ) == None
+        assert nestdict.setitem(d, ('notify', 'new', 'key'), 1) == True
+        assert d['notify']['new'] == {'key': 1}
 
     def test_getitem(self):
         """
@@ -365,6 +651,119 @@ class Test9730648:
             d['notify']['active']
         assert d['notify']['lastCheck'] == 0
 
+    def test_merge_lockstep(self):
+        """
+        Test if nestdict.merge works the same as the former path based
+        implementation, and grafts missing subdictionaries as copies.
+        """
+        for first, second in ((self.defaults, self.local),
+                              (self.local, self.defaults),
+                              ({'svn': 1}, self.defaults),
+                              ({}, self.defaults),):
+            for kwargs in ({},
+                           {'func_if_overwrite': False},
+                           {'func_if_extend': False},
+                           {'dict_type': nestdict.NestedDict}):
+                assert nestdict.merge(first, second, return_new=True,
+                                      **kwargs
+                       ) == merge_by_paths(first, second,
+                                                     return_new=True,
+                                                     **kwargs)
+        d = nestdict.merge({}, self.defaults,
+                           dict_type=nestdict.NestedDict)
+        assert d == self.defaults
+        assert type(d['notify']['notifo']) == nestdict.NestedDict
+        assert d['notify'] is not self.defaults['notify']
+        # empty subdictionaries have no values to merge
+        assert nestdict.merge({}, {'a': {}, 'b': {'c': {}}}) == {}
+        # a value blocking the path is restructured
+        assert nestdict.merge({'notify': 1}, self.local
+                              )['notify'] == self.local['notify']
+
+    def test_merge_blocking_value(self):
+        """
+        Test if clearing a value blocking a path is decided as overwriting
+        and restructuring.
+        """
+        for kwargs in ({'func_if_overwrite': False},
+                       {'restruct': False},
+                       {'func_if_extend': False},
+                       {'func_if_overwrite': lambda p, d1, d2: p != ['a']}):
+            assert nestdict.merge({'a': 1}, {'a': {'b': 2}},
+                                  return_new=True, **kwargs) == {'a': 1}
+        assert nestdict.merge({'a': 1}, {'a': {'b': 2}}) == {'a': {'b': 2}}
+        asked = []
+        def func_if_overwrite(path, d1, d2):
+            asked.append(path)
+            return True
+        nestdict.merge({'a': 1}, {'a': {'b': 2}},
+                       func_if_overwrite=func_if_overwrite)
+        assert asked == [['a']]
+        locked = nestdict.NestedDict({'a': 1})
+        locked.lock = True
+        locked.merge({'a': {'b': 2}})
+        assert locked == {'a': 1}
+
+    def test_NestedChainMap(self):
+        """
+        Test if a NestedChainMap of the layers reads the same as their
+        merge.
+        """
+        view = nestdict.NestedChainMap(self.local, self.defaults)
+        assert view.materialize() == self.local_expected
+        assert type(view.materialize()['notify']) == nestdict.NestedDict
+        assert sorted(view.paths()) == sorted(self.defaults_paths_v)
+        assert sorted(view.paths(of_values=False)
+                      ) == sorted(self.defaults_paths_d)
+        for path, value in zip(self.defaults_paths_v,
+                               self.local_expected_vals):
+            assert view[path] == value
+        assert view['notify']['active'] is False
+        assert isinstance(view['notify'], nestdict.NestedChainMap)
+        assert len(view) == 2 and len(view['notify']) == 4
+        assert ['notify', 'nothing'] not in view
+        # the view follows the layers
+        override = {'notify': {'active': True}}
+        view = view.new_child(override)
+        assert view[['notify', 'active']] is True
+        override['svn'] = None
+        assert view['svn'] is None
+        assert self.defaults['svn'] == ""
+        # a value blocks the path, empty subdictionaries are ignored
+        view = nestdict.NestedChainMap({'notify': 1, 'svn': {}},
+                                       self.defaults)
+        assert view.materialize() == nestdict.merge(self.defaults,
+            {'notify': 1, 'svn': {}}, return_new=True)
+        with pytest.raises(KeyError):
+            view[['notify', 'email']]
+
+    def test_flatten(self):
+        """
+        Test of flatten and unflatten functions.
+        """
+        records = [self.defaults, self.local_expected]
+        columns = nestdict.flatten(records)
+        assert list(columns) == ['/'.join(p) for p in self.defaults_paths_v]
+        assert columns['notify/notifo/secret'] == ["", "1234"]
+        assert columns['notify/active'] == [False, False]
+        assert nestdict.unflatten(columns) == records
+        columns = nestdict.flatten(iter(records), sep='.',
+                                   schema=[['notify', 'lastCheck']])
+        assert columns == {'notify.lastCheck': [0, 0]}
+        columns = nestdict.flatten(records, schema=[['notify', 'lastCheck']],
+                                   typecode='l')
+        assert columns['notify/lastCheck'].typecode == 'l'
+        assert nestdict.unflatten(columns) == [{'notify': {'lastCheck': 0}}
+                                               ] * 2
+        with pytest.raises(KeyError):
+            nestdict.flatten([self.defaults, self.local])
+        assert nestdict.flatten([]) == {}
+        for columns in ({'a': [1], 'a/b': [2]},
+                        {'a/b': [1], 'a': [2]},
+                        {'a': [1], 'b': [1, 2]}):
+            with pytest.raises(ValueError):
+                nestdict.unflatten(columns)
+
 class Test12586179:
     """
     Test nestdict on Stack Overflow Question #12586179:
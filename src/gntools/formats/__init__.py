@@ -24,11 +24,21 @@ Usage:
 # ------------------------------------------------------------------------
 __all__ = ['wotdossiercache']
 
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import ctypes
+import ctypes.util
 import datetime
+import errno
+import heapq
+import itertools
 import os
+import select
 import stat
+import struct
 import threading
 import time
+import traceback
 
 # TODO: Links
 # TODO: plain text fingerprints / sxntax highlighting / comparing
@@ -38,6 +48,25 @@ from gntools.core.hashcalc import md5f as md5sum
 import gntools.formats
 
 CHECK_FREQUENCY=25
+# directories modified in the last RACY_NS nanoseconds are listed again on
+# the next check, as entries added in the same clock tick do not change the
+# modification time
+RACY_NS = 10 ** 9
+# seconds EventDetective and Scheduler wait for more events to come before
+# they check
+EVENT_LATENCY = 0.05
+# Scheduler doubles the check interval of paths without changes up to
+# BACKOFF times their frequency
+BACKOFF = 8
+
+# changes File.changed() reports by the stat_result fields they compare;
+# access time is left out as reading the file (e.g. hashing) alters it
+STAT_CHANGES = (
+                ('size', 'st_size'),
+                ('lastmetachange', 'st_mtime_ns'),
+                ('lastcontentchange', 'st_ctime_ns'),
+                ('inode', 'st_ino'),
+                )
 LOG_STRING = '{} -- {}: **{}**>>**{}**' # time, name, args, result
 
 verbatim = False
@@ -74,16 +103,14 @@ def ls(path, verbose=False):
     result = {'d': [], 'f': []}
     fullpath = addr(path)
     if verbose > 1: print('* ls startfullpath: {}'.format(fullpath))
-    elemlist = [e for e in os.listdir(fullpath)]
-    if verbose > 1: print('* ls elemlist: {}'.format(elemlist))
-    for elem in elemlist:
-        elemfullpath = addr('{}/{}'.format(fullpath, elem))
-        if verbose > 1:
-            print('* ls elemfullpath: {}'.format(elemfullpath))
-        if os.path.isdir(elemfullpath):
-            result['d'].append(elemfullpath)
-        elif os.path.isfile(elemfullpath):
-            result['f'].append(elemfullpath)
+    with os.scandir(fullpath) as entries:
+        for entry in entries:
+            if verbose > 1:
+                print('* ls elemfullpath: {}'.format(entry.path))
+            if entry.is_dir():
+                result['d'].append(entry.path)
+            elif entry.is_file():
+                result['f'].append(entry.path)
     return result
 
 class StdIn:
@@ -95,20 +122,52 @@ class Path:
         self.fullpath = addr(path)
         self.hashing = hashing
         self.changes = set()
+        self.events = []
         self.lock = threading.Lock()
 
     def __repr__(self):
         return self.fullpath
 
-    def investigate(self, frequency=CHECK_FREQUENCY):
-        self.detective = Detective(self, frequency=frequency)
-        self.detective.start()
+    def __getstate__(self):
+        # Locks and running detectives can not be pickled, so they are
+        # left out. This makes Paths transferable between processes.
+        state = self.__dict__.copy()
+        del state['lock']
+        state.pop('detective', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def investigate(self, frequency=CHECK_FREQUENCY, events=True,
+                    backoff=BACKOFF, recursively=False, scheduler=None):
+        """
+        Starts watching the path by scheduler (the shared one of
+        default_scheduler() if not given), which calls changed() every
+        frequency seconds, less often if the path does not change (see
+        Scheduler.watch()). If events=True and inotify is available
+        (Linux), changed() is also called right after events of the path,
+        which are stored in self.events.
+        """
+        if scheduler is None:
+            scheduler = default_scheduler()
+        scheduler.watch(self, frequency=frequency, events=events,
+                        backoff=backoff, recursively=recursively)
+        scheduler.start()
+        self.detective = scheduler
+
+    def uninvestigate(self):
+        """Stops watching the path."""
+        detective = self.__dict__.pop('detective', None)
+        if detective is not None:
+            detective.unwatch(self)
 
 
 class File(Path):
-    def __init__(self, path, hashing=False):
+    def __init__(self, path, hashing=False, stat_result=None):
         super().__init__(path, hashing=hashing)
-        self.previous_report = self._report()
+        self.previous_report = self._report(stat_result)
         self.report = self.previous_report
 
 
@@ -146,48 +205,62 @@ class File(Path):
     def md5sum(self):
         return md5sum(self.fullpath)
 
-    @logger
-    def _report(self):
+    def _report(self, stat_result=None, md5=None):
+        """
+        Returns the report of the file made of one os.stat() result, which
+        is done if stat_result is not given. The md5sum is calculated if
+        hashing and md5 is not given.
+        """
+        if stat_result is None:
+            stat_result = os.stat(self.fullpath)
+        path, name_ = os.path.split(self.fullpath)
         result = {
-                  'name': name(self.fullpath),
-                  'path': dirname(self.fullpath),
-                  'size': self.size(),
-                  'lastaccess': self.lastaccess(),
-                  'lastmetachange': self.lastmetachange(),
-                  'lastcontentchange': self.lastcontentchange(),
+                  'name': name_,
+                  'path': path,
+                  'size': stat_result.st_size,
+                  'lastaccess': datetime.datetime.fromtimestamp(
+                                                    stat_result.st_atime),
+                  'lastmetachange': datetime.datetime.fromtimestamp(
+                                                    stat_result.st_mtime),
+                  'lastcontentchange': datetime.datetime.fromtimestamp(
+                                                    stat_result.st_ctime),
                   'hashing': self.hashing,
+                  'stat': stat_result,
                   }
         if self.hashing:
-            result.update({'md5sum': self.md5sum()})
+            result.update({'md5sum': md5 or self.md5sum()})
 
         return result
 
     @logger
     def changed(self):
+        """
+        Returns the set of changes of the file since the last call (see
+        STAT_CHANGES, 'md5sum' if hashing, or 'deleted'). It needs only
+        one os.stat() call, which the new report is made of.
+        """
         self.changes = set()
 
-        if not os.path.exists(self.fullpath):
+        try:
+            stat_result = os.stat(self.fullpath)
+        except OSError:
             self.changes.add('deleted')
             return self.changes
 
-        if self.size() != self.report['size']:
-            self.changes.add('size')
-        if self.lastaccess() != self.report['lastaccess']:
-            self.changes.add('lastaccess')
-        if self.lastmetachange() != self.report['lastmetachange']:
-            self.changes.add('lastmetachange')
-        if self.lastcontentchange() != self.report['lastcontentchange']:
-            self.changes.add('lastcontentchange')
+        previous = self.report['stat']
+        for change, field in STAT_CHANGES:
+            if getattr(stat_result, field) != getattr(previous, field):
+                self.changes.add(change)
 
-        if not self.hashing:
-            return self.changes
-
-        if self.md5sum() != self.report['md5sum']:
-            self.changes.add('md5sum')
+        md5 = None
+        if self.hashing:
+            md5 = self.md5sum()
+            if md5 != self.report['md5sum']:
+                self.changes.add('md5sum')
 
         if self.changes:
             self.previous_report = self.report
-            self.report = self._report()
+            self.report = self._report(stat_result, md5)
         return self.changes
 
     @property
@@ -201,27 +274,166 @@ class File(Path):
             os.chmod(self.fullpath, stat.S_IWRITE)
         
 
+class DirectoryDiff(namedtuple('DirectoryDiff', ['added_files',
+                                                 'removed_files',
+                                                 'modified_files',
+                                                 'added_dirs',
+                                                 'removed_dirs'])):
+    """
+    Changes of a directory tree found by Directory.changed(): sets of
+    File and Directory objects. Added directories contain their tree.
+    It is true if anything has changed.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return any(self)
+
+def _listing_key(stat_result):
+    """
+    Returns what tells if a directory has to be listed again, or None if
+    its modification time is too recent to rely on.
+    """
+    if time.time_ns() - stat_result.st_mtime_ns < RACY_NS:
+        return None
+    return (stat_result.st_ino, stat_result.st_mtime_ns)
+
 class Directory(Path):
-    def __init__(self, path, hashing=False):
+    def __init__(self, path, hashing=False, workers=None):
+        """
+        Builds the tree of the directory. Each directory is read once by
+        os.scandir() which tells the type of entries, and files are
+        stat'ed once. If workers is given, subdirectories are scanned
+        parallel by a pool of that many threads.
+        """
+        self._init(path, hashing)
+        if not workers:
+            pending = [self]
+            while pending:
+                pending.extend(pending.pop()._scan())
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(self._scan)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for subdir in future.result():
+                        pending.add(executor.submit(subdir._scan))
+
+    def _init(self, path, hashing):
         super().__init__(path, hashing=hashing)
         self.sub = set()
         self.files = set()
-        dir_ = ls(self.fullpath)
-        for fullpath in dir_['d']:
-            self.sub.add(Directory(fullpath, hashing=self.hashing))
-        for fullpath in dir_['f']:
-            self.files.add(File(fullpath, hashing=self.hashing))
+
+    def _scan(self):
+        """
+        Reads the directory into self.files and self.sub and returns the
+        new subdirectories, which are not scanned yet.
+        """
+        result = []
+        try:
+            self._listed = _listing_key(os.stat(self.fullpath))
+            entries = os.scandir(self.fullpath)
+        except FileNotFoundError:
+            # removed since its parent was read: it stays empty, and the
+            # next changed() of the parent reports it removed
+            self._listed = None
+            return result
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdir = type(self).__new__(type(self))
+                        subdir._init(entry.path, self.hashing)
+                        result.append(subdir)
+                    elif entry.is_file():
+                        self.files.add(File(entry.path,
+                                            hashing=self.hashing,
+                                            stat_result=entry.stat()))
+                except FileNotFoundError:
+                    # removed since the directory was read
+                    continue
+        self.sub.update(result)
+        return result
+
+    def _rescan(self, diff):
+        """
+        Reads the directory again, updates self.files, self.sub and diff
+        by the entries added and removed, and returns the subdirectories
+        which were there already.
+        """
+        files = {f.fullpath: f for f in self.files}
+        subdirs = {d.fullpath: d for d in self.sub}
+        result = []
+        with os.scandir(self.fullpath) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdir = subdirs.pop(entry.path, None)
+                        if subdir is None:
+                            subdir = type(self)(entry.path,
+                                                hashing=self.hashing)
+                            self.sub.add(subdir)
+                            diff.added_dirs.add(subdir)
+                        else:
+                            result.append(subdir)
+                    elif entry.is_file():
+                        if files.pop(entry.path, None) is None:
+                            f = File(entry.path, hashing=self.hashing,
+                                     stat_result=entry.stat())
+                            self.files.add(f)
+                            diff.added_files.add(f)
+                except FileNotFoundError:
+                    # removed since the directory was read
+                    continue
+        self.files.difference_update(files.values())
+        diff.removed_files.update(files.values())
+        self.sub.difference_update(subdirs.values())
+        diff.removed_dirs.update(subdirs.values())
+        return result
 
     @logger
     def changed(self, recursively=False):
-        self.changes = set()
-        # TODO: code recursiely=True case
-        if not recursively:
-            for f in self.files:
+        """
+        Returns the DirectoryDiff of the directory (and its subdirectories
+        if recursively=True) since the last check or the build of the
+        tree, and updates the tree.
+
+        Directories are read again only if their modification time (which
+        is altered by adding, removing or renaming entries only) has
+        changed, and files are checked by File.changed(), so a check costs
+        one os.stat() per directory and file in the end.
+        """
+        diff = DirectoryDiff(set(), set(), set(), set(), set())
+        pending = [(self, None)]
+        while pending:
+            directory, parent = pending.pop()
+            try:
+                stat_result = os.stat(directory.fullpath)
+            except OSError:
+                diff.removed_dirs.add(directory)
+                if parent is not None:
+                    parent.sub.discard(directory)
+                continue
+            key = _listing_key(stat_result)
+            if key is None or key != directory._listed:
+                directory._listed = key
+                subdirs = directory._rescan(diff)
+            else:
+                subdirs = directory.sub
+            for f in list(directory.files):
+                if f in diff.added_files:
+                    continue
                 changes = f.changed()
-                if changes:
-                    self.changes.add(f)
-        return self.changes
+                if 'deleted' in changes:
+                    directory.files.discard(f)
+                    diff.removed_files.add(f)
+                elif changes:
+                    diff.modified_files.add(f)
+            if recursively:
+                pending.extend((subdir, directory) for subdir in subdirs)
+        self.changes = diff
+        return diff
 
     def content(self, r=False, sort='date', reverse=False):
         """
@@ -264,3 +476,658 @@ class Detective(threading.Thread):
             with self.target_.lock:
                 self.changed = self.target_.changed()
             time.sleep(self.frequency)
+
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+
+# kinds of events by masks, in order of precedence
+EVENT_KINDS = (
+               (IN_CREATE, 'created'),
+               (IN_DELETE | IN_DELETE_SELF, 'deleted'),
+               (IN_MOVED_FROM | IN_MOVED_TO | IN_MOVE_SELF, 'moved'),
+               (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE, 'modified'),
+               (IN_Q_OVERFLOW, 'overflow'),
+               )
+
+# struct inotify_event without its name
+_event_struct = struct.Struct('iIII')
+
+_libc = None
+
+def inotify_available():
+    """Returns True if inotify can be used through libc."""
+    global _libc
+    if _libc is None:
+        _libc = False
+        name = ctypes.util.find_library('c')
+        if name:
+            try:
+                libc = ctypes.CDLL(name, use_errno=True)
+                if hasattr(libc, 'inotify_init1'):
+                    _libc = libc
+            except OSError:
+                pass
+    return bool(_libc)
+
+class Inotify:
+    """
+    Minimal ctypes binding of the Linux inotify API. Instances own an
+    inotify file descriptor, so close() them when they are not needed.
+    """
+    def __init__(self):
+        if not inotify_available():
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self._check(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        # watched paths by watch descriptors
+        self.paths = dict()
+
+    def fileno(self):
+        return self.fd
+
+    def _check(self, result, path=None):
+        if result < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return result
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._check(_libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                                 mask), path)
+        self.paths[wd] = path
+        return wd
+
+    def rm_watch(self, wd):
+        if self.paths.pop(wd, None) is not None:
+            _libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """
+        Returns the list of pending events as (path, mask, cookie, name)
+        tuples without blocking, where path is the watched path and name
+        is the name of the entry in it (empty for the path itself).
+        """
+        result = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return result
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _event_struct.unpack_from(data,
+                                                                     offset)
+                offset += _event_struct.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                path = self.paths.get(wd)
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                result.append((path, mask, cookie, name))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.paths.clear()
+
+def event_kind(mask):
+    """Returns the kind of an inotify event (see EVENT_KINDS) or None."""
+    for bits, kind in EVENT_KINDS:
+        if mask & bits:
+            return kind
+
+class _Watcher:
+    """
+    Inotify watches of directories shared by the paths which need them: a
+    directory is watched once and released when nobody needs it anymore.
+    """
+    def __init__(self):
+        self.inotify = Inotify()
+        # watch descriptors and numbers of users by watched directories
+        self.wds = dict()
+        self.users = dict()
+
+    def fileno(self):
+        return self.inotify.fileno()
+
+    def watch_dir(self, path):
+        """
+        Watches path for one more user and returns its watch descriptor.
+        Raises OSError if inotify can not watch it.
+        """
+        wd = self.wds.get(path)
+        if wd is None:
+            wd = self.wds[path] = self.inotify.add_watch(path)
+        self.users[path] = self.users.get(path, 0) + 1
+        return wd
+
+    def unwatch_dir(self, path, wd):
+        """
+        Releases path watched as wd by watch_dir(). Watches of removed
+        directories are gone already, even if they are watched again.
+        """
+        if self.wds.get(path) != wd:
+            return
+        self.users[path] -= 1
+        if not self.users[path]:
+            del self.users[path]
+            del self.wds[path]
+            self.inotify.rm_watch(wd)
+
+    def read(self):
+        """
+        Returns the pending events as (path, fullpath, mask) tuples, where
+        path is the watched directory and fullpath is the entry concerned.
+        """
+        result = []
+        for path, mask, cookie, name in self.inotify.read():
+            if mask & IN_IGNORED and path is not None:
+                # the watched directory is gone
+                self.wds.pop(path, None)
+                self.users.pop(path, None)
+            fullpath = os.path.join(path, name) if path and name else path
+            result.append((path, fullpath, mask))
+        return result
+
+    def close(self):
+        self.inotify.close()
+        self.wds.clear()
+        self.users.clear()
+
+def _watch_tree(fullpath, watch_dir):
+    """
+    Calls watch_dir() for fullpath and its subdirectories, each before
+    reading the directory, so no new subdirectory gets missed. Subtrees
+    which can not be read or watched (removed in the meantime, not
+    permitted or out of watches) are skipped, they are polled only, but
+    OSErrors of fullpath itself are raised. So are the subtrees of
+    directories watch_dir() returns False for.
+    """
+    pending = [fullpath]
+    while pending:
+        path = pending.pop()
+        try:
+            if watch_dir(path) is False:
+                continue
+            with os.scandir(path) as entries:
+                pending.extend(e.path for e in entries
+                               if e.is_dir(follow_symlinks=False))
+        except OSError:
+            if path == fullpath:
+                raise
+            continue
+
+def _created_dir(mask):
+    """Returns True if an inotify event tells a new subdirectory."""
+    return bool(mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO))
+
+class EventDetective(threading.Thread):
+    """
+    Detective which calls changed() of its target right after inotify
+    events of it (a few tenths of a second later, to collect the rest of
+    the burst), and every frequency seconds without events as well, so
+    the changes sets are the same as with polling.
+
+    Files are watched through their directories, to notice them being
+    replaced. Directories are watched with all their subdirectories if
+    recursively=True. The last batch of events is stored as (fullpath,
+    kind) tuples in events.
+    """
+    def __init__(self,
+                 PathObj,
+                 frequency=CHECK_FREQUENCY,
+                 latency=EVENT_LATENCY,
+                 recursively=False,
+                 ):
+        self.target_ = PathObj
+        self.frequency = frequency
+        self.latency = latency
+        self.recursively = recursively
+        self.events = []
+        self._lock = threading.Lock()
+        self._stopped = False
+        self.watcher = _Watcher()
+        self._wakeup = os.pipe()
+        try:
+            if not isinstance(PathObj, Directory):
+                self.watcher.watch_dir(os.path.dirname(PathObj.fullpath))
+            elif recursively:
+                _watch_tree(PathObj.fullpath, self.watcher.watch_dir)
+            else:
+                self.watcher.watch_dir(PathObj.fullpath)
+        except OSError:
+            self._close()
+            raise
+        threading.Thread.__init__(self)
+
+    def _relevant(self, events):
+        """
+        Returns the (fullpath, kind) tuples of events concerning the
+        target and watches the new subdirectories of a Directory target.
+        """
+        result = []
+        target = self.target_.fullpath
+        for path, fullpath, mask in events:
+            kind = event_kind(mask)
+            if kind is None:
+                continue
+            if isinstance(self.target_, Directory):
+                if self.recursively and _created_dir(mask):
+                    try:
+                        _watch_tree(fullpath, self.watcher.watch_dir)
+                    except OSError:
+                        pass
+            elif fullpath != target and kind != 'overflow':
+                continue
+            result.append((fullpath or target, kind))
+        return result
+
+    def run(self):
+        try:
+            if self._stopped:
+                return
+            fds = [self.watcher, self._wakeup[0]]
+            deadline = time.monotonic() + self.frequency
+            while not self._stopped:
+                timeout = max(0, deadline - time.monotonic())
+                ready = select.select(fds, [], [], timeout)[0]
+                if self._stopped:
+                    break
+                events = []
+                if ready:
+                    # collect the burst
+                    time.sleep(self.latency)
+                    events = self._relevant(self.watcher.read())
+                    if not events and time.monotonic() < deadline:
+                        continue
+                with self.target_.lock:
+                    self.events = events
+                    if self.recursively and isinstance(self.target_,
+                                                       Directory):
+                        self.changed = self.target_.changed(recursively=True)
+                    else:
+                        self.changed = self.target_.changed()
+                deadline = time.monotonic() + self.frequency
+        finally:
+            self._close()
+
+    def stop(self):
+        """
+        Stops the thread and releases the inotify instance, at once if
+        the thread is not running. Further calls do nothing.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            if self._wakeup is not None and self.is_alive():
+                # run() releases them on its way out
+                os.write(self._wakeup[1], b'\0')
+                return
+        self._close()
+
+    def _close(self):
+        with self._lock:
+            if self._wakeup is None:
+                return
+            self.watcher.close()
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+
+class _Watch:
+    """State of a path watched by a Scheduler."""
+    def __init__(self, pathobj, frequency, events, backoff, recursively):
+        self.target_ = pathobj
+        self.frequency = frequency
+        self.interval = frequency
+        self.events = events
+        self.backoff = backoff
+        self.recursively = recursively
+        # heap items of older generations are dropped
+        self.generation = 0
+        self.running = False
+        self.again = False
+        self.pending_events = []
+        # watch descriptors by the directories watched for the path
+        self.dirs = dict()
+
+class Scheduler:
+    """
+    Watches many paths with a few threads: a pool of workers calling
+    changed() of the paths when they are due, in order of a priority queue
+    of check times, and a thread listening to the events of a single
+    inotify instance (if it is available) which makes paths due at once.
+
+    Use watch() and unwatch() to manage the paths, and start() and stop()
+    to run the threads.
+    """
+    def __init__(self, workers=2, latency=EVENT_LATENCY):
+        self.workers = workers
+        self.latency = latency
+        self._cond = threading.Condition()
+        # heap of (time due, counter, generation, _Watch)
+        self._heap = []
+        self._counter = itertools.count()
+        self._watches = dict()
+        # _Watches of Directories by the directories watched for them, and
+        # _Watches of Files by their fullpaths
+        self._dir_watches = dict()
+        self._file_watches = dict()
+        self._watcher = None
+        self._wakeup = None
+        self._threads = []
+        self._running = False
+
+    def watch(self, pathobj, frequency=CHECK_FREQUENCY, events=True,
+              backoff=BACKOFF, recursively=False):
+        """
+        Starts watching pathobj (replacing its former settings if it has
+        been watched already). It is checked every frequency seconds, but
+        after each check without changes the interval doubles up to backoff
+        times frequency (backoff=1 disables it). If events=True, inotify
+        events make it checked right away. Directories are checked
+        recursively if recursively=True.
+        """
+        with self._cond:
+            self._unwatch(pathobj)
+            watch = _Watch(pathobj, frequency, events, backoff, recursively)
+            self._watches[pathobj] = watch
+            self._schedule(watch, frequency)
+            if not (self._running and events):
+                return
+        self._watch_events(watch)
+
+    def unwatch(self, pathobj):
+        """
+        Stops watching pathobj. Returns False if it was not watched.
+        """
+        with self._cond:
+            return self._unwatch(pathobj)
+
+    def _unwatch(self, pathobj):
+        watch = self._watches.pop(pathobj, None)
+        if watch is None:
+            return False
+        watch.generation += 1
+        self._unwatch_events(watch)
+        return True
+
+    def watched(self):
+        """Returns the list of watched paths."""
+        with self._cond:
+            return list(self._watches)
+
+    def start(self):
+        """Starts the threads if they are not running."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            for i in range(self.workers):
+                self._start_thread(self._work)
+            watches = [watch for watch in self._watches.values()
+                       if watch.events]
+        for watch in watches:
+            self._watch_events(watch)
+
+    def stop(self, wait=True):
+        """
+        Stops the threads (waiting for the running checks to finish if
+        wait=True) and releases the inotify instance. Paths stay watched,
+        start() goes on with them.
+        """
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+            if self._watcher is not None:
+                # the listener releases them on its way out
+                os.write(self._wakeup[1], b'\0')
+                self._detach_events()
+            threads, self._threads = self._threads, []
+        if wait:
+            for thread in threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _schedule(self, watch, delay):
+        watch.generation += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay,
+                                    next(self._counter), watch.generation,
+                                    watch))
+        self._cond.notify()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, counter, generation, watch = self._heap[0]
+                    if generation != watch.generation:
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    break
+                watch.running = True
+                events, watch.pending_events = watch.pending_events, []
+            changes = True
+            target = watch.target_
+            try:
+                with target.lock:
+                    target.events = events
+                    if watch.recursively and isinstance(target, Directory):
+                        changes = target.changed(recursively=True)
+                    else:
+                        changes = target.changed()
+            except Exception:
+                traceback.print_exc()
+            with self._cond:
+                watch.running = False
+                if self._watches.get(target) is not watch:
+                    continue
+                if changes:
+                    watch.interval = watch.frequency
+                else:
+                    watch.interval = min(watch.interval * 2,
+                                         watch.frequency * watch.backoff)
+                if watch.again:
+                    watch.again = False
+                    self._schedule(watch, self.latency)
+                else:
+                    self._schedule(watch, watch.interval)
+
+    def _watch_events(self, watch):
+        """
+        Watches the directories of watch by inotify. Call it without
+        holding self._cond, directory trees are walked outside of it.
+        """
+        with self._cond:
+            if not self._running or self._watches.get(watch.target_
+                                                      ) is not watch:
+                return
+            if self._watcher is None:
+                if not inotify_available():
+                    return
+                try:
+                    self._watcher = _Watcher()
+                except OSError:
+                    return
+                self._wakeup = os.pipe()
+                self._start_thread(self._listen, self._watcher,
+                                   self._wakeup)
+            watcher = self._watcher
+            target = watch.target_
+            try:
+                if not isinstance(target, Directory):
+                    self._watch_dir(watch, os.path.dirname(target.fullpath))
+                    self._file_watches.setdefault(target.fullpath, set()
+                                                  ).add(watch)
+                    return
+                if not watch.recursively:
+                    self._watch_dir(watch, target.fullpath)
+                    return
+            except OSError:
+                # the path is polled only
+                return
+        try:
+            self._watch_tree(watch, target.fullpath, watcher)
+        except OSError:
+            pass
+
+    def _watch_tree(self, watch, fullpath, watcher):
+        """
+        Watches the tree of fullpath for watch. self._cond is taken for
+        each directory only, so the walk does not hold up the workers. It
+        is given up if watch or watcher gets replaced meanwhile.
+        """
+        def watch_dir(path):
+            with self._cond:
+                if (self._watcher is not watcher or
+                    self._watches.get(watch.target_) is not watch):
+                    return False
+                self._watch_dir(watch, path)
+        _watch_tree(fullpath, watch_dir)
+
+    def _watch_dir(self, watch, path):
+        """
+        Adds path to the directories watched for watch. Raises OSError if
+        inotify can not watch it.
+        """
+        wd = watch.dirs.get(path)
+        if wd is not None and wd == self._watcher.wds.get(path):
+            return
+        watch.dirs[path] = self._watcher.watch_dir(path)
+        if isinstance(watch.target_, Directory):
+            self._dir_watches.setdefault(path, set()).add(watch)
+
+    def _unwatch_events(self, watch):
+        for path, wd in watch.dirs.items():
+            watches = self._dir_watches.get(path)
+            if watches is not None:
+                watches.discard(watch)
+                if not watches:
+                    del self._dir_watches[path]
+            if self._watcher is not None:
+                self._watcher.unwatch_dir(path, wd)
+        watch.dirs.clear()
+        watches = self._file_watches.get(watch.target_.fullpath)
+        if watches is not None:
+            watches.discard(watch)
+            if not watches:
+                del self._file_watches[watch.target_.fullpath]
+
+    def _detach_events(self):
+        self._watcher = self._wakeup = None
+        self._dir_watches.clear()
+        self._file_watches.clear()
+        for watch in self._watches.values():
+            watch.dirs.clear()
+
+    def _listen(self, watcher, wakeup):
+        """
+        Dispatches the events of watcher until stop() detaches it from
+        self, then releases it and the wakeup pipe.
+        """
+        fds = [watcher, wakeup[0]]
+        try:
+            while True:
+                select.select(fds, [], [])
+                with self._cond:
+                    if self._watcher is not watcher:
+                        return
+                # collect the burst
+                time.sleep(self.latency)
+                with self._cond:
+                    if self._watcher is not watcher:
+                        return
+                    trees = list()
+                    for path, fullpath, mask in watcher.read():
+                        trees.extend(self._dispatch(path, fullpath, mask))
+                for watch, fullpath in trees:
+                    try:
+                        self._watch_tree(watch, fullpath, watcher)
+                    except OSError:
+                        pass
+        finally:
+            watcher.close()
+            for fd in wakeup:
+                os.close(fd)
+
+    def _dispatch(self, path, fullpath, mask):
+        """
+        Makes the paths concerned by an inotify event due: Directories
+        watching path and the File at fullpath. Returns the list of
+        (_Watch, fullpath) tuples of new subdirectories to watch.
+        """
+        result = list()
+        if mask & IN_IGNORED:
+            # the watched directory is gone
+            for watch in self._dir_watches.pop(path, ()):
+                watch.dirs.pop(path, None)
+        kind = event_kind(mask)
+        if kind is None:
+            return result
+        if kind == 'overflow':
+            for watch in self._watches.values():
+                self._wake(watch, (None, kind))
+            return result
+        for watch in self._dir_watches.get(path, ()):
+            if watch.recursively and _created_dir(mask):
+                result.append((watch, fullpath))
+            self._wake(watch, (fullpath, kind))
+        for watch in self._file_watches.get(fullpath, ()):
+            self._wake(watch, (fullpath, kind))
+        return result
+
+    def _wake(self, watch, event):
+        watch.pending_events.append(event)
+        if watch.running:
+            watch.again = True
+        else:
+            self._schedule(watch, 0)
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+def default_scheduler():
+    """Returns the Scheduler shared by Path.investigate() calls."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+        return _default_scheduler
@@ -37,7 +37,7 @@ Usage: File(lkt_file)
 # ------------------------------------------------------------------------
 import gntools.formats
 
-from gntools.core.collections import DictList
+from gntools.collecns import DictList
 from gntools.core.types import deftype, str2type
 
 RULE_TYPES = ('-', '=')
@@ -55,14 +55,33 @@ Usage: File(sdf_file)
 
 # 0. You just DO WHAT THE FUCK YOU WANT TO.
 # ------------------------------------------------------------------------
+from array import array
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import gntools.formats
-from gntools.core.collections import NestedDict
+from gntools.collecns.nestdict import NestedDict, setitem
 
 FORMAT_DEF_CHARS = '@=<>!'
 SEPARATOR = '\t'
 
+# byte order characters of numpy dtypes by format definition characters
+NUMPY_BYTE_ORDERS = {'@': '=', '=': '=', '<': '<', '>': '>', '!': '>'}
+
+# numpy dtype kinds and array.array typecodes by format characters;
+# values of characters missing from ARRAY_TYPECODES are stored in lists
+NUMPY_KINDS = {'b': 'i', 'h': 'i', 'i': 'i', 'l': 'i', 'q': 'i', 'n': 'i',
+               'B': 'u', 'H': 'u', 'I': 'u', 'L': 'u', 'Q': 'u', 'N': 'u',
+               'P': 'u', 'e': 'f', 'f': 'f', 'd': 'f', '?': 'b', 'c': 'S',
+               's': 'S', 'p': 'S'}
+ARRAY_TYPECODES = {'b': 'b', 'h': 'h', 'i': 'i', 'l': 'l', 'q': 'q',
+                   'B': 'B', 'H': 'H', 'I': 'I', 'L': 'L', 'Q': 'Q',
+                   'e': 'f', 'f': 'f', 'd': 'd', '?': 'B'}
+
 class InvalidFormatDefinitionCharError(Exception): pass
 class SDFSyntaxError(Exception): pass
 class WrongDataLengthError(Exception): pass
@@ -87,6 +106,10 @@ class File(gntools.formats.File):
 
             self.obj.append(row_data)
 
+        self._struct = None
+        self._names = None
+        self._fields = None
+        self._template = None
 
     def load(self):
         with open(self.fullpath) as f:
@@ -110,7 +133,49 @@ class File(gntools.formats.File):
 
     def structsize(self):
         """Returns the size of binary data which can be parsed."""
-        return struct.calcsize(self.format())
+        return self.compiled().size
+
+    def compile(self):
+        """
+        Compiles the definition and caches the result: a struct.Struct
+        object, the tuple of names matching its unpacked values and a
+        template of the nested dictionary get_dict() builds. Call it again
+        if self.type_ or self.obj has been altered since.
+        """
+        self._struct = struct.Struct(self.format())
+        self._names = tuple(row[1] for row in self.reduced())
+
+        # (name, format character, offset) tuples of named rows
+        self._fields = list()
+        fmt = self.type_
+        for row in self.obj:
+            fmt += row[0]
+            if len(row) == 2:
+                offset = struct.calcsize(fmt) - struct.calcsize(
+                                                       self.type_ + row[0])
+                self._fields.append((row[1], row[0], offset))
+
+        if len(self._names) != len(self._struct.unpack(
+                                              bytes(self._struct.size))):
+            raise SDFSyntaxError(
+                    'Names and format characters do not match in {}'
+                    .format(self.fullpath)
+                )
+
+        # The template maps keys to indexes of the unpacked values. It is
+        # built by setitem() so colliding names behave like they did when
+        # get_dict() stored values one by one.
+        self._template = dict()
+        for i, name in enumerate(self._names):
+            setitem(self._template, name.split('/'), i)
+
+        return self._struct
+
+    def compiled(self):
+        """Returns the cached struct.Struct object, compiles if needed."""
+        if self._struct is None:
+            self.compile()
+        return self._struct
 
     def reduced(self):
         """
@@ -135,38 +200,77 @@ class File(gntools.formats.File):
         False. This case parsing starts from start of data and ends where
         it ends.
         """
+        values = self.unpack(data, force_length=force_length)
+        return list(zip(self._names, values))
+
+    def unpack(self, data, force_length=True, offset=0):
+        """
+        Parses a binary data and returns the tuple of values without names.
+        force_length works exactly the same as for parse(). If offset is
+        given, parsing starts there without slicing data.
+        """
+        s = self.compiled()
+        length = len(data) - offset
 
-        if force_length and len(data) != self.structsize():
+        if force_length and length != s.size:
             raise WrongDataLengthError(
                     'Data length of {} expected, got {}'
-                    .format(self.structsize(), len(data))
+                    .format(s.size, length)
                 )
 
-        elif not force_length and len(data) < self.structsize():
+        elif not force_length and length < s.size:
             raise WrongDataLengthError(
                     'Data length of minimum {} expected, got {}'
-                    .format(self.structsize(), len(data))
+                    .format(s.size, length)
                 )
 
-        if not force_length:
-            data = data[:self.structsize()]
+        return s.unpack_from(data, offset)
+
+    def iter_unpack(self, data, offsets=None, stride=None, start=0):
+        """
+        Generator of value tuples of many records stored in one buffer
+        (bytes, bytearray, memoryview, mmap, ...). Records are never
+        sliced out of data, so nothing gets copied.
+
+        Records start at the given offsets. If offsets is None they follow
+        each other from start by stride bytes (structsize() by default)
+        as long as a whole record fits in data.
+        """
+        s = self.compiled()
 
-        data_array = struct.unpack(self.format(), data)
-        reduced_self = self.reduced()
+        if offsets is not None:
+            for offset in offsets:
+                yield self.unpack(data, force_length=False, offset=offset)
+            return
 
-        if len(data_array) != len(reduced_self):
+        if stride is None:
+            stride = s.size
+        elif stride < s.size:
             raise WrongDataLengthError(
-                    'Weird, parsed array lengths do not match: {} != {}'
-                    .format(len(data_array), len(reduced_self))
+                    'Stride of minimum {} expected, got {}'
+                    .format(s.size, stride)
                 )
 
-        result = list()
-        for e in enumerate(data_array):
-            result.append((reduced_self[e[0]][1], e[1]))
+        count = (len(data) - start + stride - s.size) // stride
+        if count <= 0:
+            return
 
-        return result
+        if stride == s.size:
+            view = memoryview(data)[start:start + count * stride]
+            yield from s.iter_unpack(view)
+        else:
+            for offset in range(start, start + count * stride, stride):
+                yield s.unpack_from(data, offset)
 
-    def get_dict(self, data, force_length=True):
+    def iter_dicts(self, data, offsets=None, stride=None, start=0):
+        """
+        Same as iter_unpack() but yields dictionaries like get_dict().
+        """
+        for values in self.iter_unpack(data, offsets=offsets,
+                                       stride=stride, start=start):
+            yield self._build(values)
+
+    def get_dict(self, data, force_length=True, offset=0):
         """
         Parses a binary data and returns a dictionary. The dictionary
         becomes nested if the SDF line name contained '/', e.g. for line 2
@@ -176,11 +280,103 @@ class File(gntools.formats.File):
         >>> s.get_dict(data)['tankdata']['version']
         >>> 26
 
-        force_length works exactly the same as for parse().
+        force_length and offset work exactly the same as for unpack().
+        """
+        return self._build(self.unpack(data, force_length=force_length,
+                                       offset=offset))
+
+    def _build(self, values):
+        """Returns a NestedDict of values arranged by self._template."""
+        def walker(template):
+            for key, i in template.items():
+                if isinstance(i, dict):
+                    yield (key, NestedDict(walker(i)))
+                else:
+                    yield (key, values[i])
+        self.compiled()
+        return NestedDict(walker(self._template))
+
+    def dtype(self):
+        """
+        Returns the numpy structured dtype of the definition. Field names
+        are the full name strings, pad bytes are left out but the offsets
+        of the fields and the item size remain those of the binary data.
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required for dtype()')
+        s = self.compiled()
+        order = NUMPY_BYTE_ORDERS[self.type_]
+        names, formats, offsets = list(), list(), list()
+        for name, char, offset in self._fields:
+            kind = NUMPY_KINDS[char[-1]]
+            size = struct.calcsize(self.type_ + char)
+            if kind == 'S' or size == 1:
+                formats.append('{}{}'.format(kind, size))
+            else:
+                formats.append('{}{}{}'.format(order, kind, size))
+            names.append(name)
+            offsets.append(offset)
+        return numpy.dtype({'names': names, 'formats': formats,
+                            'offsets': offsets, 'itemsize': s.size})
+
+    def to_array(self, data, offsets=None, stride=None, start=0):
+        """
+        Decodes many records stored in one buffer into a numpy structured
+        array of dtype(). Arguments work the same as for iter_unpack().
+
+        Without offsets the array is a view on data, nothing is copied
+        (and it is read-only if data is). Aggregation becomes simple:
+
+        >>> a = s.to_array(data)
+        >>> a['damageDealt'].sum()
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required for to_array()')
+        dtype = self.dtype()
+
+        if offsets is not None:
+            return numpy.array(list(self.iter_unpack(data, offsets=offsets)),
+                               dtype=dtype)
+
+        if stride is None:
+            stride = dtype.itemsize
+        elif stride < dtype.itemsize:
+            raise WrongDataLengthError(
+                    'Stride of minimum {} expected, got {}'
+                    .format(dtype.itemsize, stride)
+                )
+        count = max(0, (len(data) - start + stride - dtype.itemsize)
+                       // stride)
+        if not count:
+            # numpy checks the offset against data even for no items
+            return numpy.empty(0, dtype=dtype)
+        return numpy.ndarray(shape=(count,), dtype=dtype, buffer=data,
+                             offset=start, strides=(stride,))
+
+    def columns(self, data, offsets=None, stride=None, start=0,
+                use_numpy=True):
+        """
+        Decodes many records stored in one buffer and returns a dictionary
+        of columns where keys are the full name strings. Arguments work the
+        same as for iter_unpack().
+
+        Columns are fields of to_array() if NumPy is available and
+        use_numpy=True, otherwise they are array.array objects (or lists
+        for bytes and other values array.array can not store).
         """
-        result = NestedDict()
-        for i in self.parse(data, force_length=force_length):
-            result[i[0].split('/')] = i[1]
+        if use_numpy and numpy is not None:
+            a = self.to_array(data, offsets=offsets, stride=stride,
+                              start=start)
+            return {name: a[name] for name in a.dtype.names}
+
+        self.compiled()
+        rows = list(self.iter_unpack(data, offsets=offsets, stride=stride,
+                                     start=start))
+        cols = zip(*rows) if rows else [()] * len(self._fields)
+        result = dict()
+        for (name, char, offset), col in zip(self._fields, cols):
+            typecode = ARRAY_TYPECODES.get(char[-1])
+            result[name] = array(typecode, col) if typecode else list(col)
         return result
 
 if __name__ == '__main__':
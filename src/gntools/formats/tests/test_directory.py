@@ -0,0 +1,289 @@
+import os
+import shutil
+
+import pytest
+
+import gntools.formats as formats
+
+def names(objs):
+    return {os.path.basename(obj.fullpath) for obj in objs}
+
+def age(tree):
+    """
+    Sets the modification time of the directories of tree far enough in
+    the past to rely on it, as if RACY_NS had passed.
+    """
+    past = os.stat(tree).st_mtime_ns - 10 * formats.RACY_NS
+    for path, dirs, files in os.walk(tree):
+        os.utime(path, ns=(past, past))
+
+@pytest.fixture
+def tree(tmp_path):
+    """
+    tmp_path holding f1, a/f2, a/b/f3 and an empty directory c.
+    """
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'c').mkdir()
+    for f in ('f1', 'a/f2', 'a/b/f3'):
+        (tmp_path / f).write_text('x')
+    return tmp_path
+
+def tree_of(directory):
+    """
+    Returns the set of (directory, files) tuples of the tree of directory
+    by relative paths.
+    """
+    root = directory.fullpath
+    result = set()
+    pending = [directory]
+    while pending:
+        d = pending.pop()
+        result.add((os.path.relpath(d.fullpath, root),
+                    frozenset(names(d.files))))
+        pending.extend(d.sub)
+    return result
+
+class VanishingEntries(list):
+    """Entries of os.scandir() read in advance."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+class TestDirectoryBuild:
+    """
+    Test the trees Directory builds.
+    """
+    def test_workers(self, tmp_path):
+        """
+        Test if building by a pool of workers gives the same tree as the
+        serial build.
+        """
+        for i in range(4):
+            for j in range(5):
+                sub = tmp_path / 'd{}'.format(i) / 'e{}'.format(j)
+                sub.mkdir(parents=True)
+                for k in range(j):
+                    (sub / 'f{}'.format(k)).write_text('x')
+        (tmp_path / 'f').write_text('x')
+        serial = formats.Directory(tmp_path)
+        parallel = formats.Directory(tmp_path, workers=4)
+        assert tree_of(parallel) == tree_of(serial)
+        assert len(tree_of(serial)) == 25
+        assert names(parallel.content(r=True)) == names(
+                                                    serial.content(r=True))
+
+    @pytest.mark.parametrize('workers', [None, 4])
+    def test_vanishing(self, tree, monkeypatch, workers):
+        """
+        Test if entries removed while the directory is being read are
+        skipped, and removed subdirectories are reported by the next
+        check.
+        """
+        scandir = os.scandir
+        def vanishing(path):
+            entries = list(scandir(path))
+            if os.path.samefile(path, tree):
+                (tree / 'f1').unlink()
+                shutil.rmtree(tree / 'a')
+            return VanishingEntries(entries)
+        monkeypatch.setattr(formats.os, 'scandir', vanishing)
+        directory = formats.Directory(tree, workers=workers)
+        monkeypatch.undo()
+        assert directory.files == set()
+        assert names(directory.sub) == {'a', 'c'}
+        diff = directory.changed(recursively=True)
+        assert names(diff.removed_dirs) == {'a'}
+        assert not diff.removed_files
+        assert tree_of(directory) == {('.', frozenset()),
+                                      ('c', frozenset())}
+
+class TestDirectoryChanged:
+    """
+    Test the DirectoryDiffs of Directory.changed().
+    """
+    def test_no_change(self, tree, monkeypatch):
+        """
+        Test if nothing is reported without changes, and directories are
+        not listed again.
+        """
+        age(tree)
+        directory = formats.Directory(tree)
+        rescanned = []
+        rescan = formats.Directory._rescan
+        def spy(d, diff):
+            rescanned.append(d)
+            return rescan(d, diff)
+        monkeypatch.setattr(formats.Directory, '_rescan', spy)
+        diff = directory.changed(recursively=True)
+        assert not diff
+        assert diff == formats.DirectoryDiff(set(), set(), set(), set(),
+                                             set())
+        assert rescanned == []
+
+    def test_files(self, tree):
+        """
+        Test if added, removed and modified files are reported in
+        subdirectories too.
+        """
+        directory = formats.Directory(tree)
+        (tree / 'f4').write_text('x')
+        (tree / 'a' / 'b' / 'f5').write_text('x')
+        (tree / 'a' / 'f2').unlink()
+        (tree / 'a' / 'b' / 'f3').write_text('xyz')
+        diff = directory.changed(recursively=True)
+        assert diff
+        assert names(diff.added_files) == {'f4', 'f5'}
+        assert names(diff.removed_files) == {'f2'}
+        assert names(diff.modified_files) == {'f3'}
+        assert not diff.added_dirs and not diff.removed_dirs
+        assert names(directory.content(r=True)) == {'f1', 'f3', 'f4', 'f5'}
+        assert not directory.changed(recursively=True)
+
+    def test_dirs(self, tree):
+        """
+        Test if added and removed directories are reported, and added
+        ones come with their tree.
+        """
+        directory = formats.Directory(tree)
+        shutil.rmtree(tree / 'a')
+        (tree / 'd' / 'e').mkdir(parents=True)
+        (tree / 'd' / 'e' / 'f6').write_text('x')
+        diff = directory.changed(recursively=True)
+        assert names(diff.removed_dirs) == {'a'}
+        assert names(diff.added_dirs) == {'d'}
+        assert not diff.added_files and not diff.removed_files
+        added, = diff.added_dirs
+        assert names(added.content(r=True)) == {'f6'}
+        assert names(directory.sub) == {'c', 'd'}
+        assert names(directory.content(r=True)) == {'f1', 'f6'}
+        assert not directory.changed(recursively=True)
+
+    def test_not_recursively(self, tree):
+        """
+        Test if only the directory itself is checked by default.
+        """
+        directory = formats.Directory(tree)
+        (tree / 'a' / 'f4').write_text('x')
+        (tree / 'f1').write_text('xyz')
+        diff = directory.changed()
+        assert names(diff.modified_files) == {'f1'}
+        assert not diff.added_files
+        assert names(directory.changed(recursively=True).added_files
+                     ) == {'f4'}
+
+    def test_racy(self, tree):
+        """
+        Test if directories modified in the last RACY_NS nanoseconds are
+        listed again even if their modification time stays the same.
+        """
+        directory = formats.Directory(tree)
+        st = os.stat(tree)
+        (tree / 'f4').write_text('x')
+        # added in the same clock tick as the listing
+        os.utime(tree, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert names(directory.changed().added_files) == {'f4'}
+
+    def test_trusted_listing(self, tree):
+        """
+        Test if directories with an older modification time are not
+        listed again while it stays the same.
+        """
+        age(tree)
+        directory = formats.Directory(tree)
+        st = os.stat(tree)
+        (tree / 'f4').write_text('x')
+        os.utime(tree, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert not directory.changed().added_files
+        os.utime(tree)
+        assert names(directory.changed().added_files) == {'f4'}
+
+class TestFileChanged:
+    """
+    Test the changes File.changed() reports from a single os.stat().
+    """
+    @pytest.fixture(autouse=True)
+    def setup_file(self, tmp_path):
+        self.path = tmp_path / 'f1'
+        self.path.write_text('abc')
+
+    def keep_mtime(self, st):
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_no_change(self):
+        """
+        Test if reading the file is no change, as access time is left
+        out.
+        """
+        f = formats.File(self.path)
+        assert f.changed() == set()
+        self.path.read_text()
+        assert f.changed() == set()
+        assert 'lastaccess' in f.report
+
+    def test_stat_changes(self):
+        """
+        Test if changes of each compared stat field are reported.
+        """
+        f = formats.File(self.path)
+        os.chmod(self.path, 0o600)
+        assert f.changed() == {'lastcontentchange'}
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert f.changed() == {'lastmetachange', 'lastcontentchange'}
+        self.path.write_text('abcd')
+        assert f.changed() == {'size', 'lastmetachange',
+                               'lastcontentchange'}
+
+    def test_inode(self):
+        """
+        Test if replacing the file by one of the same size and
+        modification time is reported.
+        """
+        f = formats.File(self.path)
+        other = self.path.with_name('f2')
+        other.write_text('xyz')
+        os.utime(other, ns=(f.report['stat'].st_atime_ns,
+                            f.report['stat'].st_mtime_ns))
+        os.replace(other, self.path)
+        changes = f.changed()
+        assert 'inode' in changes
+        assert 'size' not in changes and 'lastmetachange' not in changes
+
+    def test_md5sum(self):
+        """
+        Test if content changes keeping the size and the modification time
+        are reported by hashing Files only.
+        """
+        f = formats.File(self.path)
+        hashing = formats.File(self.path, hashing=True)
+        st = os.stat(self.path)
+        self.path.write_text('xyz')
+        self.keep_mtime(st)
+        assert f.changed() == {'lastcontentchange'}
+        assert hashing.changed() == {'md5sum', 'lastcontentchange'}
+        assert hashing.report['md5sum'] == formats.md5sum(str(self.path))
+
+    def test_deleted(self):
+        """
+        Test if a removed file is reported as deleted.
+        """
+        f = formats.File(self.path)
+        self.path.unlink()
+        assert f.changed() == {'deleted'}
+
+    def test_report(self):
+        """
+        Test if the report is refreshed by changes, so they are reported
+        once, and the previous one is kept.
+        """
+        f = formats.File(self.path)
+        report = f.report
+        self.path.write_text('abcd')
+        assert 'size' in f.changed()
+        assert f.previous_report is report
+        assert f.previous_report['size'] == 3
+        assert f.report['size'] == 4
+        assert f.changed() == set()
+        assert f.previous_report is report
@@ -0,0 +1,321 @@
+import os
+import shutil
+import time
+
+import pytest
+
+import gntools.formats as formats
+
+needs_inotify = pytest.mark.skipif(not formats.inotify_available(),
+                                   reason='inotify is not available')
+
+class Counter(formats.Path):
+    """
+    Path counting the calls of changed(), which reports changes while
+    self.changing is True.
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = 0
+        self.changing = False
+
+    def changed(self):
+        self.calls += 1
+        return {'changed'} if self.changing else set()
+
+def wait_for(condition, timeout=5):
+    """Waits for condition() to be true, returns False on timeout."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+@pytest.fixture
+def scheduler():
+    result = formats.Scheduler(workers=2, latency=0.01)
+    yield result
+    result.stop()
+
+class TestScheduler:
+    """
+    Test the checks and inotify watches of Scheduler.
+    """
+    def test_backoff(self, scheduler, tmp_path):
+        """
+        Test if the interval doubles after checks without changes up to
+        backoff times the frequency, and a change resets it.
+        """
+        counter = Counter(tmp_path)
+        scheduler.watch(counter, frequency=0.01, events=False, backoff=4)
+        watch = scheduler._watches[counter]
+        scheduler.start()
+        assert wait_for(lambda: counter.calls >= 5)
+        assert watch.interval == 0.04
+        counter.changing = True
+        calls = counter.calls
+        assert wait_for(lambda: counter.calls > calls + 1)
+        assert watch.interval == 0.01
+
+    def test_unwatch(self, scheduler, tmp_path):
+        """
+        Test if unwatched paths are not checked anymore.
+        """
+        counter = Counter(tmp_path)
+        scheduler.watch(counter, frequency=0.01, backoff=1)
+        scheduler.start()
+        assert wait_for(lambda: counter.calls >= 2)
+        assert scheduler.watched() == [counter]
+        assert scheduler.unwatch(counter)
+        assert not scheduler.unwatch(counter)
+        assert scheduler.watched() == []
+        time.sleep(0.05)
+        calls = counter.calls
+        time.sleep(0.05)
+        assert counter.calls == calls
+
+    def test_stop_start(self, scheduler, tmp_path):
+        """
+        Test if stopped schedulers do not check, and go on with the same
+        paths when started again.
+        """
+        counter = Counter(tmp_path)
+        scheduler.watch(counter, frequency=0.01, backoff=1)
+        scheduler.start()
+        assert wait_for(lambda: counter.calls >= 2)
+        scheduler.stop()
+        calls = counter.calls
+        time.sleep(0.05)
+        assert counter.calls == calls
+        assert scheduler._watcher is None
+        scheduler.start()
+        assert wait_for(lambda: counter.calls > calls)
+
+    def test_investigate(self, scheduler, tmp_path):
+        """
+        Test if Paths are watched by investigate() until uninvestigate().
+        """
+        directory = formats.Directory(tmp_path)
+        directory.investigate(frequency=0.01, events=False,
+                              scheduler=scheduler)
+        assert scheduler.watched() == [directory]
+        (tmp_path / 'f1').write_text('x')
+        assert wait_for(lambda: directory.changes
+                        and directory.changes.added_files)
+        directory.uninvestigate()
+        assert scheduler.watched() == []
+
+    @needs_inotify
+    def test_directory_events(self, scheduler, tmp_path):
+        """
+        Test if events check Directories at once, and new subdirectories
+        are watched if recursively=True.
+        """
+        (tmp_path / 'a').mkdir()
+        flat = formats.Directory(tmp_path)
+        tree = formats.Directory(tmp_path)
+        scheduler.watch(flat, frequency=100)
+        scheduler.watch(tree, frequency=100, recursively=True)
+        scheduler.start()
+        (tmp_path / 'f1').write_text('x')
+        assert wait_for(lambda: flat.changes and tree.changes)
+        assert flat.events and tree.events
+        (tmp_path / 'a' / 'b').mkdir()
+        b = str(tmp_path / 'a' / 'b')
+        assert wait_for(lambda: {b} ==
+                        {d.fullpath for d in tree.changes.added_dirs})
+        assert b in scheduler._dir_watches
+        (tmp_path / 'a' / 'b' / 'f2').write_text('x')
+        assert wait_for(lambda: {os.path.join(b, 'f2')} ==
+                        {f.fullpath for f in tree.changes.added_files})
+        assert scheduler._dir_watches[str(tmp_path)] == {
+                   scheduler._watches[flat], scheduler._watches[tree]}
+        # events in subdirectories do not concern flat
+        assert scheduler._dir_watches[b] == {scheduler._watches[tree]}
+        assert set(scheduler._watches[flat].dirs) == {str(tmp_path)}
+
+    @needs_inotify
+    def test_file_events(self, scheduler, tmp_path):
+        """
+        Test if events of a File check it at once, but events of other
+        entries in its directory do not.
+        """
+        (tmp_path / 'f1').write_text('x')
+        (tmp_path / 'f2').write_text('x')
+        f1 = formats.File(tmp_path / 'f1')
+        f2 = formats.File(tmp_path / 'f2')
+        for f in (f1, f2):
+            scheduler.watch(f, frequency=100)
+        scheduler.start()
+        (tmp_path / 'f1').write_text('xyz')
+        assert wait_for(lambda: 'size' in f1.changes)
+        assert f1.events == [(f1.fullpath, 'modified')] * len(f1.events)
+        assert f2.events == []
+        assert set(scheduler._file_watches) == {f1.fullpath, f2.fullpath}
+        # both Files share the watch of their directory
+        assert list(scheduler._watcher.users.values()) == [2]
+
+    @needs_inotify
+    @pytest.mark.filterwarnings(
+        'error::pytest.PytestUnhandledThreadExceptionWarning')
+    def test_restart(self, scheduler, tmp_path):
+        """
+        Test if stop(wait=False) followed by start() leaves the old
+        listener to release its inotify instance, and events reach the new
+        one.
+        """
+        directory = formats.Directory(tmp_path)
+        scheduler.watch(directory, frequency=100)
+        fds = open_fds()
+        threads = list()
+        for i in range(5):
+            scheduler.start()
+            watcher = scheduler._watcher
+            threads.extend(scheduler._threads)
+            scheduler.stop(wait=False)
+            assert scheduler._watcher is None
+        scheduler.start()
+        assert scheduler._watcher is not watcher
+        assert wait_for(lambda: watcher.inotify.fd == -1)
+        (tmp_path / 'f1').write_text('x')
+        assert wait_for(lambda: directory.changes
+                        and directory.changes.added_files)
+        scheduler.stop()
+        for thread in threads:
+            thread.join()
+        assert open_fds() == fds
+
+    @needs_inotify
+    def test_walk_unlocked(self, scheduler, tmp_path, monkeypatch):
+        """
+        Test if directory trees are read without holding the lock of the
+        scheduler, when watched and when created.
+        """
+        (tmp_path / 'a' / 'b').mkdir(parents=True)
+        directory = formats.Directory(tmp_path)
+        locked = list()
+        scandir = os.scandir
+        def spy(path):
+            locked.append(scheduler._cond._is_owned())
+            return scandir(path)
+        monkeypatch.setattr(formats.os, 'scandir', spy)
+        scheduler.start()
+        scheduler.watch(directory, frequency=100, recursively=True)
+        assert len(locked) == 3
+        (tmp_path / 'c' / 'd').mkdir(parents=True)
+        assert wait_for(lambda: str(tmp_path / 'c' / 'd')
+                        in scheduler._dir_watches)
+        assert len(locked) > 3
+        assert not any(locked)
+
+    @needs_inotify
+    def test_unwatch_events(self, scheduler, tmp_path):
+        """
+        Test if the inotify watches are released by unwatch(), and the
+        ones of removed directories are dropped.
+        """
+        (tmp_path / 'a' / 'b').mkdir(parents=True)
+        directory = formats.Directory(tmp_path)
+        scheduler.watch(directory, frequency=100, recursively=True)
+        scheduler.start()
+        watcher = scheduler._watcher
+        assert set(watcher.wds) == {str(tmp_path), str(tmp_path / 'a'),
+                                    str(tmp_path / 'a' / 'b')}
+        shutil.rmtree(tmp_path / 'a')
+        assert wait_for(lambda: set(watcher.wds) == {str(tmp_path)})
+        assert set(scheduler._dir_watches) == {str(tmp_path)}
+        scheduler.unwatch(directory)
+        assert watcher.wds == {}
+        assert scheduler._dir_watches == {}
+
+@needs_inotify
+class TestEventDetective:
+    """
+    Test the checks and stopping of EventDetective.
+    """
+    def detective(self, pathobj, **kwargs):
+        detective = formats.EventDetective(pathobj, frequency=100,
+                                           latency=0.01, **kwargs)
+        detective.start()
+        return detective
+
+    def test_directory_events(self, tmp_path):
+        """
+        Test if events check the Directory at once, and subdirectories are
+        watched only if recursively=True.
+        """
+        (tmp_path / 'a').mkdir()
+        flat = self.detective(formats.Directory(tmp_path))
+        tree = self.detective(formats.Directory(tmp_path), recursively=True)
+        try:
+            assert set(flat.watcher.wds) == {str(tmp_path)}
+            assert set(tree.watcher.wds) == {str(tmp_path),
+                                             str(tmp_path / 'a')}
+            (tmp_path / 'f1').write_text('x')
+            f1 = str(tmp_path / 'f1')
+            for detective in (flat, tree):
+                assert wait_for(lambda: getattr(detective, 'changed', None))
+                assert (f1, 'created') in detective.events
+                assert detective.changed.added_files
+            (tmp_path / 'a' / 'b').mkdir()
+            assert wait_for(lambda: str(tmp_path / 'a' / 'b')
+                            in tree.watcher.wds)
+            assert set(flat.watcher.wds) == {str(tmp_path)}
+        finally:
+            flat.stop()
+            tree.stop()
+        flat.join()
+        tree.join()
+
+    def test_file_events(self, tmp_path):
+        """
+        Test if only the events of a File check it.
+        """
+        (tmp_path / 'f1').write_text('x')
+        f1 = formats.File(tmp_path / 'f1')
+        detective = self.detective(f1)
+        try:
+            (tmp_path / 'f2').write_text('x')
+            time.sleep(0.05)
+            assert not hasattr(detective, 'changed')
+            (tmp_path / 'f1').write_text('xyz')
+            assert wait_for(lambda: getattr(detective, 'changed', None))
+            assert 'size' in detective.changed
+            assert set(detective.events) == {(f1.fullpath, 'modified')}
+        finally:
+            detective.stop()
+        detective.join()
+
+    def test_stop(self, tmp_path):
+        """
+        Test if stop() releases the file descriptors, also if the thread
+        has never been started, and further calls do nothing.
+        """
+        fds = open_fds()
+        detectives = [formats.EventDetective(formats.Directory(tmp_path))
+                      for i in range(5)]
+        assert open_fds() > fds
+        for detective in detectives:
+            detective.stop()
+        assert open_fds() == fds
+        detectives[0].start()
+        detectives[0].join()
+
+        detective = self.detective(formats.Directory(tmp_path))
+        detective.stop()
+        detective.join()
+        assert open_fds() == fds
+        # a new pipe likely gets the closed file descriptors
+        r, w = os.pipe()
+        try:
+            detective.stop()
+            os.set_blocking(r, False)
+            with pytest.raises(BlockingIOError):
+                os.read(r, 1)
+        finally:
+            os.close(r)
+            os.close(w)
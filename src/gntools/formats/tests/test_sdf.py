@@ -0,0 +1,239 @@
+from array import array
+import struct
+
+import pytest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gntools.collecns.nestdict import NestedDict
+import gntools.formats.sdf as sdf
+
+DEFINITION = '=\nh\ta/x\n2x\nl\ta/y\nd\tz\n'
+
+@pytest.fixture
+def definition(tmp_path):
+    """sdf.File of DEFINITION written to tmp_path."""
+    path = tmp_path / 'test.sdf'
+    path.write_text(DEFINITION)
+    return sdf.File(str(path))
+
+needs_numpy = pytest.mark.skipif(numpy is None,
+                                 reason='NumPy is not available')
+
+def pack(*values):
+    return struct.pack('=h2xld', *values)
+
+class TestDecode:
+    """
+    Test the decoding of single records by sdf.File.
+    """
+    def test_compile(self, definition):
+        """
+        Test if the compiled struct is cached and matches the definition.
+        """
+        s = definition.compiled()
+        assert definition.compiled() is s
+        assert s.format == '=h2xld'
+        assert definition.structsize() == 16
+        assert definition._names == ('a/x', 'a/y', 'z')
+
+    def test_recompile(self, definition):
+        """
+        Test if compile() picks up the altered definition.
+        """
+        definition.compiled()
+        definition.obj.append(('b', 'flag'))
+        assert definition.compile().format == '=h2xldb'
+        assert definition.unpack(pack(1, 2, 0.5) + b'\x01') == (1, 2, 0.5, 1)
+
+    def test_names_mismatch(self, tmp_path):
+        """
+        Test if rows of many values for a single name are refused.
+        """
+        path = tmp_path / 'bad.sdf'
+        path.write_text('=\n2h\tx\n')
+        with pytest.raises(sdf.SDFSyntaxError):
+            sdf.File(str(path)).compile()
+
+    def test_unpack(self, definition):
+        """
+        Test if unpack() checks the data length unless force_length=False,
+        and starts at offset.
+        """
+        data = pack(-1, 2, 0.5)
+        assert definition.unpack(data) == (-1, 2, 0.5)
+        assert definition.parse(data) == [('a/x', -1), ('a/y', 2),
+                                          ('z', 0.5)]
+        with pytest.raises(sdf.WrongDataLengthError):
+            definition.unpack(data + b'\0')
+        assert definition.unpack(data + b'\0', force_length=False) == (
+                   -1, 2, 0.5)
+        with pytest.raises(sdf.WrongDataLengthError):
+            definition.unpack(data[:-1], force_length=False)
+        assert definition.unpack(b'xyz' + data, offset=3) == (-1, 2, 0.5)
+        with pytest.raises(sdf.WrongDataLengthError):
+            definition.unpack(b'xyz' + data, offset=2)
+
+    def test_get_dict(self, definition):
+        """
+        Test if get_dict() nests the values by the names, in new
+        NestedDicts each time.
+        """
+        data = pack(-1, 2, 0.5)
+        result = definition.get_dict(data)
+        assert result == {'a': {'x': -1, 'y': 2}, 'z': 0.5}
+        assert type(result) == NestedDict and type(result['a']) == NestedDict
+        assert definition.get_dict(data)['a'] is not result['a']
+        assert definition.get_dict(b'xyz' + data + b'\0', offset=3,
+                                   force_length=False) == result
+
+class TestBatch:
+    """
+    Test the decoding of many records of one buffer by sdf.File.
+    """
+    records = [(i, i * 10, i / 2) for i in range(5)]
+
+    def test_consecutive(self, definition):
+        """
+        Test if records following each other are decoded from start, and
+        an incomplete record at the end is left out.
+        """
+        data = b''.join(pack(*r) for r in self.records)
+        assert list(definition.iter_unpack(data)) == self.records
+        assert list(definition.iter_unpack(bytearray(data))) == self.records
+        assert list(definition.iter_unpack(b'xy' + data + b'\0' * 15,
+                                           start=2)) == self.records
+        assert list(definition.iter_unpack(data[:15])) == []
+        assert list(definition.iter_unpack(data, start=len(data))) == []
+
+    def test_stride(self, definition):
+        """
+        Test if records are decoded every stride bytes, and the last one
+        needs no trailing gap.
+        """
+        gap = b'\xff' * 4
+        data = gap + gap.join(pack(*r) for r in self.records)
+        assert list(definition.iter_unpack(data, stride=20,
+                                           start=4)) == self.records
+        with pytest.raises(sdf.WrongDataLengthError):
+            list(definition.iter_unpack(data, stride=15))
+
+    def test_offsets(self, definition):
+        """
+        Test if records are decoded at the given offsets in their order.
+        """
+        data = b'\0' + pack(*self.records[0]) + pack(*self.records[1])
+        assert list(definition.iter_unpack(data, offsets=[17, 1])) == [
+                   self.records[1], self.records[0]]
+        with pytest.raises(sdf.WrongDataLengthError):
+            list(definition.iter_unpack(data, offsets=[18]))
+
+    def test_iter_dicts(self, definition):
+        """
+        Test if iter_dicts() yields the dictionaries of get_dict().
+        """
+        data = b''.join(pack(*r) for r in self.records)
+        assert list(definition.iter_dicts(data, offsets=[16, 0])) == [
+                   definition.get_dict(pack(*self.records[1])),
+                   definition.get_dict(pack(*self.records[0]))]
+        assert list(definition.iter_dicts(data, stride=16)) == [
+                   definition.get_dict(pack(*r)) for r in self.records]
+
+class TestColumns:
+    """
+    Test the columnar decoding of sdf.File.
+    """
+    records = [(i, -i, i / 2) for i in range(5)]
+
+    @pytest.fixture
+    def data(self):
+        return b''.join(pack(*r) for r in self.records)
+
+    @needs_numpy
+    def test_dtype(self, definition):
+        """
+        Test if the dtype leaves out the pad bytes but keeps the offsets
+        and the size of the records.
+        """
+        dtype = definition.dtype()
+        assert dtype.names == ('a/x', 'a/y', 'z')
+        assert [dtype.fields[name][1] for name in dtype.names] == [0, 4, 8]
+        assert dtype.itemsize == 16
+
+    @needs_numpy
+    def test_to_array(self, definition, data):
+        """
+        Test if the array is a view on data with the values of
+        iter_unpack().
+        """
+        a = definition.to_array(data)
+        assert a.tolist() == self.records
+        assert numpy.shares_memory(a, numpy.frombuffer(data, numpy.uint8))
+        assert a['a/y'].sum() == -10
+        assert definition.to_array(b'x' + data, start=1).tolist() == (
+                   self.records)
+        assert definition.to_array(data, offsets=[32, 0]).tolist() == [
+                   self.records[2], self.records[0]]
+
+    @needs_numpy
+    def test_to_array_stride(self, definition):
+        """
+        Test if records are taken every stride bytes.
+        """
+        gap = b'\xff' * 4
+        data = gap.join(pack(*r) for r in self.records)
+        assert definition.to_array(data, stride=20).tolist() == self.records
+        with pytest.raises(sdf.WrongDataLengthError):
+            definition.to_array(data, stride=15)
+
+    @needs_numpy
+    def test_to_array_empty(self, definition, data):
+        """
+        Test if an empty array of the dtype is returned when no record
+        fits in data, also if start is past its end.
+        """
+        for a in (definition.to_array(data[:15]),
+                  definition.to_array(data, start=len(data) + 16)):
+            assert a.shape == (0,)
+            assert a.dtype == definition.dtype()
+
+    @needs_numpy
+    @pytest.mark.parametrize('char', ['<', '>', '!'])
+    def test_byte_order(self, tmp_path, char):
+        """
+        Test if the byte order of the definition is kept by the dtype, and
+        the columns match the ones decoded without NumPy.
+        """
+        path = tmp_path / 'order.sdf'
+        path.write_text('{}\nh\tx\nB\ty\n4s\tz\nd\tw\n'.format(char))
+        definition = sdf.File(str(path))
+        records = [(-2, 200, b'abcd', 1.5), (3, 0, b'efgh', -0.25)]
+        data = b''.join(definition.compiled().pack(*r) for r in records)
+        assert definition.to_array(data).tolist() == records
+        fallback = definition.columns(data, use_numpy=False)
+        assert {name: list(col) for name, col in fallback.items()} == {
+                   name: col.tolist() for name, col in
+                   definition.columns(data).items()}
+
+    def test_columns_fallback(self, definition, data, monkeypatch):
+        """
+        Test if columns are array.arrays without NumPy, with the values of
+        the NumPy columns.
+        """
+        if numpy is not None:
+            expected = {name: col.tolist() for name, col in
+                        definition.columns(data).items()}
+        monkeypatch.setattr(sdf, 'numpy', None)
+        result = definition.columns(data)
+        assert [col.typecode for col in result.values()] == ['h', 'l', 'd']
+        assert list(result['z']) == [r[2] for r in self.records]
+        if numpy is not None:
+            assert {name: list(col) for name, col in result.items()} == (
+                       expected)
+        assert definition.columns(data[:15]) == {
+                   'a/x': array('h'), 'a/y': array('l'), 'z': array('d')}
+        with pytest.raises(ImportError):
+            definition.to_array(data)
@@ -29,7 +29,7 @@ https://github.com/Phalynx/WoT-Dossier-Cache-to-JSON
 import glob
 import json
 
-from gntools.core.collections import DictList
+from gntools.collecns import DictList
 from gntools.core.path import mloc
 
 from gntools.formats import lkt
@@ -0,0 +1,552 @@
+import os
+import pickle
+import random
+import shutil
+import struct
+import sys
+import timeit
+
+import pytest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gntools.collecns.nestdict import NestedDict
+import gntools.formats.wargaming.wotdossiercache as wotdossiercache
+
+def make_dossier(path, seed=0, ntanks=20, sdf_dir=wotdossiercache.SDF_DIR,
+                 shift=0):
+    """
+    Writes a dossier cache file of random tank records of all the versions
+    of sdf_dir. shift is added to the timestamps, which changes the
+    content but not the size of the file.
+    """
+    rnd = random.Random(seed)
+    structs = wotdossiercache.get_structs(sdf_dir)
+    keys = sorted(wotdossiercache.tanks_data)
+    tanks = dict()
+    for key in rnd.sample(keys, ntanks):
+        version = rnd.choice(list(structs))
+        tank_sdf = structs[version]
+        values = list()
+        for row in tank_sdf.reduced():
+            if row[1] == 'version':
+                values.append(version)
+            elif row[1] == 'fragspos':
+                values.append(tank_sdf.structsize())
+            else:
+                values.append(rnd.randrange(100))
+        n = rnd.randrange(5)
+        frags = (struct.pack('=h', n)
+                 + struct.pack('={}l'.format(n), *rnd.sample(keys, n))
+                 + struct.pack('={}h'.format(n),
+                               *[rnd.randrange(50) for i in range(n)]))
+        record = tank_sdf.compiled().pack(*values) + frags
+        tanks[(2, key)] = (1370000000 + rnd.randrange(10**6) + shift,
+                           record.decode(wotdossiercache.ENCODING))
+    with open(path, mode='wb') as f:
+        pickle.dump((26, tanks), f, protocol=2)
+
+@pytest.fixture
+def dossier(tmp_path):
+    """Path of a dossier cache file in tmp_path."""
+    path = str(tmp_path / 'dossier.dat')
+    make_dossier(path)
+    return path
+
+class TestStructRegistry:
+    """
+    Test the structure definitions of get_structs().
+    """
+    @pytest.fixture(autouse=True)
+    def sdf_dir(self, tmp_path):
+        self.dir = tmp_path
+        for version in (2, 10):
+            self.write(version, '=\nh\tversion\n')
+        self.registry = wotdossiercache.get_structs(str(tmp_path))
+
+    def write(self, version, definition, mtime_ns=None):
+        path = self.dir / '{}.sdf'.format(version)
+        path.write_text(definition)
+        if mtime_ns is not None:
+            os.utime(str(path), ns=(mtime_ns, mtime_ns))
+
+    def test_versions(self):
+        """
+        Test if the registry maps the versions of the .sdf files of its
+        directory, and is shared by the calls of get_structs().
+        """
+        (self.dir / 'x.sdf').write_text('=\n')
+        (self.dir / '3.txt').write_text('=\n')
+        assert list(self.registry) == [2, 10]
+        assert len(self.registry) == 2
+        assert 3 not in self.registry
+        with pytest.raises(KeyError):
+            self.registry[3]
+        assert wotdossiercache.get_structs(str(self.dir)) is self.registry
+
+    def test_cached(self):
+        """
+        Test if definitions are compiled once, and parsed again when the
+        modification time of their file changes.
+        """
+        tank_sdf = self.registry[2]
+        assert tank_sdf._struct is not None
+        assert self.registry[2] is tank_sdf
+        self.write(2, '=\nh\tversion\nl\tx\n', mtime_ns=10**18)
+        changed = self.registry[2]
+        assert changed is not tank_sdf
+        assert changed.format() == '=hl'
+        assert self.registry[2] is changed
+        # restoring an older modification time counts as a change too
+        self.write(2, '=\nh\tversion\n', mtime_ns=10**9)
+        assert self.registry[2].format() == '=h'
+
+    def test_removed(self):
+        """
+        Test if the definitions of removed files are dropped.
+        """
+        self.registry[10]
+        os.remove(str(self.dir / '10.sdf'))
+        with pytest.raises(KeyError):
+            self.registry[10]
+        assert 10 not in self.registry._cache
+        assert list(self.registry) == [2]
+
+class TestLoadFiles:
+    """
+    Test the parallel decoding of load_files().
+    """
+    @pytest.fixture(autouse=True)
+    def dossiers(self, tmp_path):
+        self.paths = list()
+        for seed in range(3):
+            path = str(tmp_path / '{}.dat'.format(seed))
+            make_dossier(path, seed=seed)
+            self.paths.append(path)
+        self.broken = str(tmp_path / 'broken.dat')
+        with open(self.broken, mode='wb') as f:
+            f.write(b'not a pickle')
+        (tmp_path / 'other.txt').write_text('x')
+
+    def test_paths(self):
+        """
+        Test if the yielded Files match the ones decoded one by one.
+        """
+        result = dict(wotdossiercache.load_files(self.paths, workers=2))
+        assert set(result) == set(self.paths)
+        for path, dossier_file in result.items():
+            assert dossier_file.obj == wotdossiercache.File(path).obj
+
+    def test_directory(self, tmp_path):
+        """
+        Test if the dossier files of a directory are loaded, and failures
+        are yielded with return_exceptions=True.
+        """
+        result = dict(wotdossiercache.load_files(str(tmp_path), workers=2,
+                                                 chunksize=2,
+                                                 return_exceptions=True))
+        assert set(result) == set(self.paths) | {self.broken}
+        assert isinstance(result[self.broken], Exception)
+        for path in self.paths:
+            assert isinstance(result[path], wotdossiercache.File)
+
+    def test_raise(self):
+        """
+        Test if failures are raised by default.
+        """
+        with pytest.raises(pickle.UnpicklingError):
+            list(wotdossiercache.load_files([self.broken] + self.paths,
+                                            workers=2))
+
+class TestLazyTanks:
+    """
+    Test the decoding on access of lazy Files.
+    """
+    @pytest.fixture(autouse=True)
+    def files(self, dossier):
+        self.expected = wotdossiercache.File(dossier).obj
+        self.lazy = wotdossiercache.File(dossier, lazy=True).obj
+
+    def test_access(self):
+        """
+        Test if records are decoded on first access only, and peek() does
+        not decode.
+        """
+        key = next(iter(self.lazy))
+        assert len(self.lazy) == len(self.expected)
+        assert key in self.lazy
+        assert isinstance(self.lazy.peek(key), wotdossiercache.RawTank)
+        assert self.lazy.peek((0, 0), 'missing') == 'missing'
+        value = self.lazy[key]
+        assert value == self.expected[key]
+        assert self.lazy.peek(key) is value
+        assert self.lazy[key] is value
+        assert self.lazy.get(key) is value
+        others = [k for k in self.lazy if k != key]
+        assert all(isinstance(self.lazy.peek(k), wotdossiercache.RawTank)
+                   for k in others)
+
+    def test_decode_all(self):
+        """
+        Test if decode_all() and copy() decode all the records, and the
+        copy is a Tanks dictionary equal to the eagerly decoded one.
+        """
+        assert self.lazy.decode_all() is self.lazy
+        assert not any(isinstance(self.lazy.peek(key),
+                                  wotdossiercache.RawTank)
+                       for key in self.lazy)
+        copy = self.lazy.copy()
+        assert type(copy) == wotdossiercache.Tanks
+        assert copy == self.expected
+        assert self.lazy == self.expected
+
+    def test_pickle(self):
+        """
+        Test if pickled LazyTanks keep their undecoded records.
+        """
+        key = next(iter(self.lazy))
+        self.lazy[key]
+        loaded = pickle.loads(pickle.dumps(self.lazy))
+        assert loaded.peek(key) == self.expected[key]
+        assert sum(isinstance(loaded.peek(k), wotdossiercache.RawTank)
+                   for k in loaded) == len(loaded) - 1
+        assert loaded.copy() == self.expected
+
+class TestTitleIndex:
+    """
+    Test the title lookups of TitleIndex and Tanks.get_by_tit().
+    """
+    data = {1: {'title': 'Tiger I', 'shorttitle': 'Tiger'},
+            2: {'title': 'Tiger II', 'shorttitle': 'Tiger II'},
+            3: {'title': 'T-34', 'shorttitle': 'T-34'},
+            4: {'title': 'KV-1S', 'shorttitle': 'KV-1S'},
+            5: {'title': 'tiger i', 'shorttitle': 'Tiger?'}}
+
+    def test_find(self):
+        """
+        Test if titles are found case-insensitively as a whole only.
+        """
+        index = wotdossiercache.TitleIndex(data=self.data)
+        assert sorted(index.find('TIGER I')) == [1, 5]
+        assert index.find('Tiger') == []
+        assert wotdossiercache.TitleIndex(short=True,
+                                          data=self.data).find('tiger') == [1]
+
+    def test_prefixed(self):
+        """
+        Test if titles starting with the string are found in title order.
+        """
+        index = wotdossiercache.TitleIndex(data=self.data)
+        assert sorted(index.prefixed('tiger')) == [1, 2, 5]
+        assert index.prefixed('tiger ii') == [2]
+        assert index.prefixed('T-') == [3]
+        assert index.prefixed('zz') == []
+        assert sorted(index.prefixed('')) == sorted(self.data)
+
+    @pytest.mark.parametrize('string', ['i', 'I', '-', 'ge', '-1', 'iger',
+                                        'GER I', 'r ii', 't-34', 'x', 'xyz',
+                                        ''])
+    def test_search(self, string):
+        """
+        Test if search() finds the titles containing the string, also if
+        it is shorter than an n-gram.
+        """
+        index = wotdossiercache.TitleIndex(data=self.data)
+        assert index.search(string) == {
+                   key for key, tank in self.data.items()
+                   if string.casefold() in tank['title'].casefold()}
+
+    def test_get_by_tit(self):
+        """
+        Test if get_by_tit() looks up the tanks of the dictionary only.
+        """
+        data = wotdossiercache.tanks_data
+        keys = [key for key in data if 'T-34' in data[key]['title']]
+        tanks = wotdossiercache.Tanks((key, str(key)) for key in keys)
+        t34 = [key for key in keys if data[key]['title'] == 'T-34'][0]
+        assert tanks.get_by_tit('t-34') == str(t34)
+        assert tanks.get_by_tit('PzKpfw IV') == []
+        assert tanks.get_by_tit('34', strict=False) == sorted(
+                   (data[key]['title'], str(key)) for key in keys)
+        assert tanks.get_by_tit('34', strict=False, prefix=True) == []
+        assert tanks.get_by_tit('t-34', strict=False, prefix=True) == sorted(
+                   (data[key]['title'], str(key)) for key in keys
+                   if data[key]['title'].startswith('T-34'))
+
+class TestFrags:
+    """
+    Test the decoding of frag tables by get_frags().
+    """
+    tanks = [1, 17, 3329]
+    frags = [2, 0, 7]
+
+    @pytest.fixture
+    def table(self):
+        """Frag table of self.tanks and self.frags after two bytes."""
+        n = len(self.tanks)
+        return (b'xy' + struct.pack('=h', n)
+                + struct.pack('={}l'.format(n), *self.tanks)
+                + struct.pack('={}h'.format(n), *self.frags))
+
+    def test_tanks(self, table):
+        """
+        Test if frag counts are returned in a Tanks dictionary.
+        """
+        result = wotdossiercache.get_frags(table, offset=2)
+        assert type(result) == wotdossiercache.Tanks
+        assert result == dict(zip(self.tanks, self.frags))
+        assert wotdossiercache.get_frags(struct.pack('=h', 0)) == {}
+        with pytest.raises(wotdossiercache.sdf.WrongDataLengthError):
+            wotdossiercache.get_frags(table + b'\0', offset=2)
+        with pytest.raises(wotdossiercache.sdf.WrongDataLengthError):
+            wotdossiercache.get_frags(table[:-1], offset=2)
+
+    @pytest.mark.skipif(numpy is None, reason='NumPy is not available')
+    def test_numpy_arrays(self, table):
+        """
+        Test if as_arrays=True returns numpy arrays viewing the table.
+        """
+        tanks, frags = wotdossiercache.get_frags(table, offset=2,
+                                                 as_arrays=True)
+        assert isinstance(tanks, numpy.ndarray)
+        assert tanks.tolist() == self.tanks
+        assert frags.tolist() == self.frags
+        assert numpy.shares_memory(tanks,
+                                   numpy.frombuffer(table, numpy.uint8))
+
+    def test_arrays(self, table):
+        """
+        Test if use_numpy=False returns array.arrays.
+        """
+        tanks, frags = wotdossiercache.get_frags(table, offset=2,
+                                                 as_arrays=True,
+                                                 use_numpy=False)
+        assert tanks.itemsize == 4 and frags.itemsize == 2
+        assert tanks.tolist() == self.tanks
+        assert frags.tolist() == self.frags
+
+    @pytest.mark.parametrize('order', ['<', '>', '!'])
+    def test_byte_order(self, order, monkeypatch):
+        """
+        Test if the arrays are decoded in the byte order of STRFORMAT,
+        also if it differs from the native one.
+        """
+        monkeypatch.setattr(wotdossiercache, 'STRFORMAT', order)
+        data = struct.pack('{}3l'.format(order), *self.tanks)
+        result = wotdossiercache._frombytes('l', data)
+        assert result.itemsize == 4
+        assert result.tolist() == self.tanks
+        swapped = (order == '<') != (sys.byteorder == 'little')
+        assert (result.tobytes() != data) == swapped
+        if numpy is not None:
+            dtype = wotdossiercache._numpy_dtype('l')
+            assert numpy.frombuffer(data, dtype=dtype).tolist() == (
+                       self.tanks)
+
+class TestDelta:
+    """
+    Test the incremental decoding of Files with previous.
+    """
+    @pytest.fixture(autouse=True)
+    def dossiers(self, dossier, tmp_path):
+        """
+        Writes the next dossier of the player to self.path: a tank has
+        been played, another one has been bought.
+        """
+        with open(dossier, mode='rb') as f:
+            version, tanks = pickle.load(f)
+        keys = sorted(tanks)
+        self.added = wotdossiercache.tankfromwgkey(keys[0])
+        self.played = wotdossiercache.tankfromwgkey(keys[1])
+        current = dict(tanks)
+        current[keys[1]] = (tanks[keys[1]][0] + 3600, tanks[keys[2]][1])
+        del tanks[keys[0]]
+        self.path = str(tmp_path / 'next.dat')
+        for path, obj in ((dossier, tanks), (self.path, current)):
+            with open(path, mode='wb') as f:
+                pickle.dump((version, obj), f, protocol=2)
+        self.dossier = dossier
+        self.expected = wotdossiercache.File(self.path).obj
+
+    def test_previous(self):
+        """
+        Test if unchanged tanks are taken from previous, and the delta
+        holds the played and the new tanks.
+        """
+        previous = wotdossiercache.File(self.dossier)
+        assert previous.delta is None
+        current = wotdossiercache.File(self.path, previous=previous)
+        assert current.obj == self.expected
+        for key, value in current.obj.items():
+            if key in (self.added, self.played):
+                assert value is not previous.obj.get(key)
+            else:
+                assert value is previous.obj[key]
+        assert type(current.delta) == wotdossiercache.Tanks
+        assert current.delta == {
+                   self.added: self.expected[self.added],
+                   self.played: wotdossiercache.tank_delta(
+                                    self.expected[self.played],
+                                    previous.obj[self.played])}
+
+    def test_lazy_previous(self):
+        """
+        Test if undecoded records of lazy Files are not decoded for
+        unchanged tanks.
+        """
+        previous = wotdossiercache.File(self.dossier, lazy=True)
+        current = wotdossiercache.File(self.path, previous=previous,
+                                       lazy=True)
+        raw = [key for key in current.obj
+               if isinstance(current.obj.peek(key), wotdossiercache.RawTank)]
+        assert set(raw) == set(current.obj) - {self.added, self.played}
+        assert set(current.delta) == {self.added, self.played}
+        assert dict(current.obj) == self.expected
+        eager = wotdossiercache.File(self.path, previous=wotdossiercache.File(
+                                                             self.dossier))
+        assert current.delta == eager.delta
+
+    def test_tank_delta(self):
+        """
+        Test if deltas hold the differences of numbers and the new values
+        of anything else for the changed leaves only.
+        """
+        old = (1, wotdossiercache.TankData(
+                      a=NestedDict(x=2, y=1, z=0.5), b=False, s='old'),
+               wotdossiercache.Tanks({1: 1, 2: 4}))
+        new = (2, wotdossiercache.TankData(
+                      a=NestedDict(x=5, y=1, z=1.0), b=True, s='new',
+                      n=NestedDict(x=1)),
+               wotdossiercache.Tanks({1: 3, 2: 4, 3: 1}))
+        time, stats, frags = wotdossiercache.tank_delta(new, old)
+        assert time == 2
+        assert stats == {'a': {'x': 3, 'z': 0.5}, 'b': True, 's': 'new',
+                         'n': {'x': 1}}
+        assert type(stats) == wotdossiercache.TankData
+        assert type(stats['a']) == NestedDict
+        assert frags == {1: 2, 3: 1}
+        assert type(frags) == wotdossiercache.Tanks
+        assert wotdossiercache.tank_delta(new, new)[1:] == ({}, {})
+
+class TestCache:
+    """
+    Test the decoded cache files of File.
+    """
+    @pytest.fixture(autouse=True)
+    def cache(self, dossier, tmp_path):
+        self.path = dossier
+        self.dir = str(tmp_path)
+        self.cache_dir = str(tmp_path / 'cache')
+        self.expected = wotdossiercache.File(self.path).obj
+
+    def load(self, **kwargs):
+        return wotdossiercache.File(self.path, cache_dir=self.cache_dir,
+                                    **kwargs)
+
+    def test_round_trip(self):
+        """
+        Test if tanks loaded from the cache are the same as the decoded
+        ones, with the same types.
+        """
+        written = self.load()
+        assert written.rawobj is not None
+        assert written.obj == self.expected
+        loaded = self.load()
+        assert loaded.rawobj is None
+        assert loaded.version == written.version
+        assert type(loaded.obj) == wotdossiercache.Tanks
+        assert loaded.obj == self.expected
+        for key, (time, tank_data, frags) in loaded.obj.items():
+            assert time == self.expected[key][0]
+            assert type(tank_data) == wotdossiercache.TankData
+            assert type(frags) == wotdossiercache.Tanks
+            for value in tank_data.values():
+                if isinstance(value, dict):
+                    assert type(value) == NestedDict
+                    assert value.lock is False
+        assert [f for f in os.listdir(self.cache_dir)
+                if f.endswith('.tmp')] == []
+
+    def test_lazy(self):
+        """
+        Test if lazy Files neither read nor write the cache.
+        """
+        lazy = self.load(lazy=True)
+        assert isinstance(lazy.obj, wotdossiercache.LazyTanks)
+        assert not os.path.exists(self.cache_dir)
+        self.load()
+        lazy = self.load(lazy=True)
+        assert lazy.rawobj is not None
+        assert isinstance(lazy.obj, wotdossiercache.LazyTanks)
+        assert dict(lazy.obj) == self.expected
+
+    def test_faster(self):
+        """
+        Test if loading the cache is faster than decoding.
+        """
+        make_dossier(self.path, ntanks=len(wotdossiercache.tanks_data))
+        self.load()
+        decoding = min(timeit.repeat(
+                           lambda: wotdossiercache.File(self.path),
+                           number=1, repeat=5))
+        loading = min(timeit.repeat(self.load, number=1, repeat=5))
+        assert self.load().rawobj is None
+        assert loading < decoding
+
+    def test_source_invalidation(self):
+        """
+        Test if changing the size or the modification time of the source
+        file invalidates the cache.
+        """
+        self.load()
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert self.load().rawobj is not None
+        assert self.load().rawobj is None
+        make_dossier(self.path, seed=1, ntanks=30)
+        reloaded = self.load()
+        assert reloaded.rawobj is not None
+        assert reloaded.obj == wotdossiercache.File(self.path).obj
+        assert self.load().obj == reloaded.obj
+
+    def test_md5sum_invalidation(self):
+        """
+        Test if the md5sum is stored and checked only by hashing Files.
+        """
+        cache_path = self.load().cache_path(self.cache_dir)
+        with open(cache_path, mode='rb') as f:
+            assert wotdossiercache._read_cache_header(f)['md5sum'] is None
+        assert self.load(hashing=True).rawobj is not None
+        assert self.load(hashing=True).rawobj is None
+        # same size and modification time, different content
+        st = os.stat(self.path)
+        make_dossier(self.path, shift=1)
+        assert os.stat(self.path).st_size == st.st_size
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert self.load().rawobj is None
+        assert self.load(hashing=True).rawobj is not None
+
+    def test_sdf_invalidation(self):
+        """
+        Test if changing a used structure definition invalidates the
+        cache.
+        """
+        sdf_dir = os.path.join(self.dir, 'structs')
+        shutil.copytree(wotdossiercache.mloc(wotdossiercache.__file__,
+                                             wotdossiercache.SDF_DIR),
+                        sdf_dir)
+        self.load(sdf_dir=sdf_dir)
+        assert self.load(sdf_dir=sdf_dir).rawobj is None
+        with open(self.path, mode='rb') as f:
+            versions = {wotdossiercache._version_struct.unpack_from(
+                            record.encode(wotdossiercache.ENCODING))[0]
+                        for t, record in pickle.load(f)[1].values()}
+        sdf_path = os.path.join(sdf_dir, '{}.sdf'.format(min(versions)))
+        with open(sdf_path, newline='') as f:
+            definition = f.read()
+        with open(sdf_path, mode='w', newline='') as f:
+            f.write(definition.replace('lastBattleTime', 'lastBattle'))
+        assert self.load(sdf_dir=sdf_dir).rawobj is not None
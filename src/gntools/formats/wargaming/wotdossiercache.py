@@ -22,13 +22,27 @@ Usage: File(dossier_cache_file)
 
 # 0. You just DO WHAT THE FUCK YOU WANT TO.
 # ------------------------------------------------------------------------
+from array import array
 import base64
+from bisect import bisect_left
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import as_completed, ProcessPoolExecutor
 from datetime import datetime
+import hashlib
+import copyreg
+import json
 import os
 import pickle
 import struct
+import sys
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-from gntools.core.iterable import split_by_lenlist
 from gntools.core.path import mloc
 
 import gntools.formats
@@ -36,12 +50,15 @@ import gntools.formats.dic as dic
 import gntools.formats.lkt as lkt
 import gntools.formats.sdf as sdf
 
+from gntools.collecns.nestdict import NestedDict
 from gntools.formats.wargaming.phalynxjson import LKT_LOCATION, TANKS_LKT
 
+DOSSIER_EXT = '.dat'
 ENCODING = 'latin_1'
 # valid encodings: cp1256, latin_1, iso8859_9
 
 VERSION_STRUCT = '=h'
+_version_struct = struct.Struct(VERSION_STRUCT)
 
 tanks_data = dict()
 for tank in lkt.File(mloc(__file__, LKT_LOCATION, TANKS_LKT)).obj:
@@ -58,86 +75,492 @@ STRNUMFRAGS = 'h'
 STRFRAGS = 'h'
 STRTANKS = 'l'
 
+_numfrags_struct = struct.Struct(STRFORMAT + STRNUMFRAGS)
+_TANKS_SIZE = struct.calcsize(STRFORMAT + STRTANKS)
+_FRAGS_SIZE = struct.calcsize(STRFORMAT + STRFRAGS)
+
+CACHE_EXT = '.wdc'
+CACHE_MAGIC = b'GNWDC\x02'
+CACHE_HEADER_STRUCT = '=I'
+# Note: a decoded cache file consists of CACHE_MAGIC, the length of the
+#       JSON header, the JSON header and the pickled dictionary of the
+#       decoded tanks.
+
+_cache_header_struct = struct.Struct(CACHE_HEADER_STRUCT)
+
+_registries = dict()
+
 def get_structs(sdf_dir=SDF_DIR):
     """
-    Returns dictionary where keys are version integers and values are the
-    corresponding structure definitions.
+    Returns the process-wide StructRegistry of sdf_dir. It behaves like a
+    dictionary where keys are version integers and values are the
+    corresponding compiled structure definitions.
+    """
+    abs_sdf_dir = os.path.abspath(mloc(__file__, sdf_dir))
+    try:
+        return _registries[abs_sdf_dir]
+    except KeyError:
+        return _registries.setdefault(abs_sdf_dir,
+                                      StructRegistry(abs_sdf_dir))
+
+class StructRegistry(Mapping):
+    """
+    Read-only mapping of version integers to compiled structure
+    definitions of a directory. A definition is parsed and compiled on
+    first use of its version only, and it is parsed again if the
+    modification time of its file has changed since.
     """
-    abs_sdf_dir = mloc(__file__, sdf_dir)
-    keys = [int(f.rstrip('.sdf')) for f in os.listdir(abs_sdf_dir)]
-    values = [sdf.File('{}/{}.sdf'.format(abs_sdf_dir, v)) for v in keys]
-    return dict(zip(keys, values))
+    def __init__(self, abs_sdf_dir):
+        self.dir = abs_sdf_dir
+        self._cache = dict()
+
+    def path(self, version):
+        return os.path.join(self.dir, '{}.sdf'.format(version))
+
+    def __getitem__(self, version):
+        path = self.path(version)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._cache.pop(version, None)
+            raise KeyError(version)
+
+        cached = self._cache.get(version)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        tank_sdf = sdf.File(path)
+        tank_sdf.compile()
+        self._cache[version] = (mtime, tank_sdf)
+        return tank_sdf
+
+    def __iter__(self):
+        versions = list()
+        for f in os.listdir(self.dir):
+            name, ext = os.path.splitext(f)
+            if ext == '.sdf' and name.isdigit():
+                versions.append(int(name))
+        return iter(sorted(versions))
+
+    def __len__(self):
+        return sum(1 for version in self)
 
 class File(gntools.formats.File):
     class StructureDataDontMatchError(Exception): pass
 
-    def __init__(self, path):
-        super().__init__(path)
+    def __init__(self, path, sdf_dir=SDF_DIR, lazy=False, previous=None,
+                 cache_dir=None, hashing=False):
+        """
+        Loads and decodes the dossier cache file. If lazy=True, self.obj
+        holds the raw tank records and each of them is decoded on first
+        access only (see LazyTanks).
+
+        previous can be an earlier File of the same player. Then only the
+        records with changed timestamps get decoded, the others are taken
+        from previous, and self.delta becomes a Tanks dictionary of the
+        played tanks' (time, stats delta, frags delta) tuples (see
+        tank_delta()). Otherwise self.delta is None.
+
+        If cache_dir is given, the decoded tanks are stored there and
+        loaded from there the next time (see load_cache()), which takes
+        about half the time of decoding. The cache gets invalidated if the
+        size or modification time of the file, its md5sum (checked only if
+        hashing=True) or the used structure definitions have changed. Lazy
+        Files do not use the cache, decoding on access is cheaper.
+        """
+        super().__init__(path, hashing=hashing)
         self.version = None
+        self.delta = None
+        self.rawobj = None
 
         try:
             self.login, self.nick = _base32name(self.bnametup()[0])
         except:
             self.login, self.nick = 'n/a', 'n/a'
 
+        if lazy:
+            cache_dir = None
+        if cache_dir is not None:
+            if previous is None and self.load_cache(cache_dir,
+                                                    sdf_dir=sdf_dir):
+                return
+            # stat before reading, so a file changing meanwhile can only
+            # invalidate the cache
+            source = self._source_key()
+
         self.rawobj = self.read()
 
         self.version = self.rawobj[0]
 
-        keys = list()
-        values = list()
-        structs = get_structs()
+        # calling this many times is slow but we dont care yet
+        keys = [tankfromwgkey(key) for key in self.rawobj[1]]
 
-        for key in self.rawobj[1]:
+        rawvals = list(self.rawobj[1].values())
+        buffer, bounds = join_records(rawvals)
+        records = [RawTank(rawval[0], start, end)
+                   for rawval, (start, end) in zip(rawvals, bounds)]
 
-            # calling this many times is slow but we dont care yet
-            keys.append(tankfromwgkey(key))
+        structs = VersionStructs(get_structs(sdf_dir))
 
-            rawval = self.rawobj[1][key]
-            rawvaldata = rawval[1].encode(ENCODING)
-
-            version = struct.unpack(VERSION_STRUCT,
-                          rawvaldata[:struct.calcsize(VERSION_STRUCT)])[0]
-
-            tank_sdf = structs[version]
-            tank_data = tank_sdf.get_dict(rawvaldata, force_length=False)
+        if previous is not None:
+            self.delta = Tanks()
+            values = [self._update(key, record, previous.obj, buffer,
+                                   structs, lazy)
+                      for key, record in zip(keys, records)]
+        elif lazy:
+            values = records
+        else:
+            values = [decode_record(buffer, record, structs)
+                      for record in records]
 
-            fragspos = tank_data['fragspos']
-            del tank_data['fragspos']
+        if lazy:
+            self.obj = LazyTanks(zip(keys, values), buffer=buffer.obj,
+                                 sdf_dir=sdf_dir)
+        else:
+            self.obj = Tanks(zip(keys, values))
+
+        if cache_dir is not None:
+            versions = {_version_struct.unpack_from(buffer, record.start)[0]
+                        for record in records}
+            self.write_cache(cache_dir, versions, structs, source=source)
+
+    def cache_path(self, cache_dir):
+        """Returns the path of the decoded cache file in cache_dir."""
+        name = hashlib.md5(self.fullpath.encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, name + CACHE_EXT)
+
+    def _source_key(self):
+        st = os.stat(self.fullpath)
+        return {'path': self.fullpath, 'size': st.st_size,
+                'mtime': st.st_mtime_ns}
+
+    def write_cache(self, cache_dir, versions, structs, source=None):
+        """
+        Writes the decoded cache file of self.obj to cache_dir. versions
+        are the versions of the structure definitions of the tanks. The
+        file is replaced atomically. source is the result of
+        self._source_key() at the time the file has been read.
+        """
+        if source is None:
+            source = self._source_key()
+
+        header = {
+                  'source': source,
+                  # checked only by hashing Files, which have it in their
+                  # report already (see load_cache())
+                  'md5sum': self.report['md5sum'] if self.hashing else None,
+                  'structs': _structs_digest(structs, versions),
+                  'version': self.version,
+                  }
+        header = json.dumps(header).encode('utf-8')
+
+        os.makedirs(cache_dir, exist_ok=True)
+        path = self.cache_path(cache_dir)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        try:
+            with open(fd, mode='wb') as f:
+                f.write(CACHE_MAGIC)
+                f.write(_cache_header_struct.pack(len(header)))
+                f.write(header)
+                _CachePickler(f).dump(dict(self.obj))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return path
+
+    def load_cache(self, cache_dir, sdf_dir=SDF_DIR):
+        """
+        Loads the tanks from the decoded cache file of cache_dir if it is
+        valid, and returns True. Returns False otherwise.
+        """
+        try:
+            f = open(self.cache_path(cache_dir), mode='rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            header = _read_cache_header(f)
+            if header is None or header['source'] != self._source_key():
+                return False
+            if self.hashing and header['md5sum'] != self.report['md5sum']:
+                return False
+            structs = VersionStructs(get_structs(sdf_dir))
+            try:
+                valid = header['structs'] == _structs_digest(
+                             structs, [int(v) for v in header['structs']])
+            except KeyError:
+                valid = False
+            if not valid:
+                return False
+            self.version = header['version']
+            self.obj = Tanks(pickle.load(f))
+        return True
+
+    def _update(self, key, record, previous, buffer, structs, lazy):
+        """
+        Returns the value of a tank record for self.obj reusing the
+        previous value if its timestamp has not changed. Records the
+        delta in self.delta otherwise.
+        """
+        if isinstance(previous, LazyTanks):
+            old = previous.peek(key)
+        else:
+            old = previous.get(key)
 
-            values.append((
-                           datetime.fromtimestamp(rawval[0]),
-                           TankData(tank_data),
-                           get_frags(rawvaldata[fragspos:]),
-                           ))
+        if old is not None and _timestamp(old) == record.timestamp:
+            if not isinstance(old, RawTank):
+                return old
+            return record if lazy else decode_record(buffer, record,
+                                                     structs)
 
-        self.obj = Tanks(zip(keys, values))
+        value = decode_record(buffer, record, structs)
+        if old is None:
+            self.delta[key] = value
+        else:
+            self.delta[key] = tank_delta(value, previous[key])
+        return value
 
     def read(self):
         with open(self.fullpath, mode='rb') as f:
             r = pickle.load(f, encoding=ENCODING)
         return r
 
-def get_frags(data):
-    count_format = STRFORMAT + STRNUMFRAGS
-    count_len = struct.calcsize(count_format)
+RawTank = namedtuple('RawTank', ['timestamp', 'start', 'end'])
+RawTank.__doc__ = """
+Undecoded tank record: its timestamp and its start and end offsets in the
+buffer returned by join_records().
+"""
 
-    count = struct.unpack(count_format, data[:count_len])[0]
+class VersionStructs(dict):
+    """
+    Memoizes structure definitions of a StructRegistry, so each definition
+    file gets stat-ed only once, e.g. per dossier cache file.
+    """
+    def __init__(self, registry):
+        super().__init__()
+        self.registry = registry
 
-    fragged_tanks_format = STRFORMAT + STRTANKS*count
-    frags_count_format = STRFORMAT + STRFRAGS*count
+    def __missing__(self, version):
+        return self.setdefault(version, self.registry[version])
 
-    tanks_data_len = struct.calcsize(fragged_tanks_format)
-    frags_data_len = struct.calcsize(frags_count_format)
+def decode_record(buffer, record, structs):
+    """
+    Decodes a RawTank record of buffer and returns a tuple of its time,
+    TankData and frags. structs is a mapping of version integers to
+    structure definitions.
+    """
+    start, end = record.start, record.end
+    version = _version_struct.unpack_from(buffer, start)[0]
+    tank_data = structs[version].get_dict(buffer, force_length=False,
+                                          offset=start)
 
-    lengths = [count_len, tanks_data_len, frags_data_len]
-    sliced_data = [d for d in split_by_lenlist(data, lengths)]
+    fragspos = tank_data['fragspos']
+    del tank_data['fragspos']
 
-    tuple_tanks = struct.unpack(fragged_tanks_format, sliced_data[1])
-    tuple_frags = struct.unpack(frags_count_format, sliced_data[2])
+    return (
+            datetime.fromtimestamp(record.timestamp),
+            TankData(tank_data),
+            get_frags(memoryview(buffer)[:end], offset=start+fragspos),
+            )
 
-    return Tanks(zip(tuple_tanks, tuple_frags))
+def tank_delta(new, old):
+    """
+    Returns the (time, stats delta, frags delta) tuple of two decoded
+    values of the same tank. Deltas contain the changed leaves only:
+    differences of numbers and new values of anything else.
+    """
+    return (new[0], _delta(new[1], old[1]), _delta(new[2], old[2]))
+
+def _delta(new, old):
+    result = type(new)()
+    for key, value in new.items():
+        old_value = old.get(key) if isinstance(old, dict) else None
+        if isinstance(value, dict):
+            sub = _delta(value, old_value or {})
+            if sub:
+                result[key] = sub
+        elif value == old_value:
+            continue
+        elif isinstance(value, (int, float)) and isinstance(
+                          old_value, (int, float)) and not isinstance(
+                                                       value, bool):
+            result[key] = value - old_value
+        else:
+            result[key] = value
+    return result
 
+def _timestamp(value):
+    """Returns the timestamp of a RawTank or decoded tank value."""
+    if isinstance(value, RawTank):
+        return value.timestamp
+    return value[0].timestamp()
+
+def _structs_digest(structs, versions):
+    """
+    Returns a dictionary of md5 hexdigests of the given versions'
+    structure definitions by version strings.
+    """
+    result = dict()
+    for version in versions:
+        tank_sdf = structs[version]
+        definition = repr((tank_sdf.format(), tank_sdf.reduced()))
+        result[str(version)] = hashlib.md5(
+                                  definition.encode('utf-8')).hexdigest()
+    return result
+
+def _read_cache_header(f):
+    """
+    Reads the JSON header of a decoded cache file from f and returns it,
+    or None if f is not a decoded cache file.
+    """
+    if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+        return None
+    try:
+        length = _cache_header_struct.unpack(
+                     f.read(_cache_header_struct.size))[0]
+        return json.loads(f.read(length).decode('utf-8'))
+    except (struct.error, ValueError):
+        return None
+
+def _reduce_nested(obj):
+    # the NestedDicts of decoded tanks have no attributes to keep
+    return (NestedDict, (dict(obj),))
+
+class _CachePickler(pickle.Pickler):
+    """
+    Pickler of decoded tanks for cache files. NestedDicts are pickled as
+    plain dictionaries passed to NestedDict(), so unpickling fills them at
+    C speed instead of item by item through NestedDict.__setitem__().
+    """
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[NestedDict] = _reduce_nested
+
+    def __init__(self, f):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_files(paths, workers=None, chunksize=1, return_exceptions=False,
+               sdf_dir=SDF_DIR):
+    """
+    Generator which decodes many dossier cache files in parallel and yields
+    (path, File) tuples as they complete, so not in the order of paths.
+
+    paths is either a directory (its DOSSIER_EXT files are loaded) or an
+    iterable of file paths. Files are decoded by a pool of workers
+    processes (os.cpu_count() by default), chunksize files per task. Each
+    worker compiles the structure definitions once and reuses them for
+    all of its files.
+
+    If decoding a file fails, the exception is raised here, unless
+    return_exceptions=True which yields it in place of the File.
+    """
+    if isinstance(paths, str):
+        paths = [f for f in gntools.formats.ls(paths)['f']
+                 if os.path.splitext(f)[1] == DOSSIER_EXT]
+    paths = list(paths)
+    chunks = [paths[i:i+chunksize] for i in range(0, len(paths), chunksize)]
+
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=_init_worker,
+                                   initargs=(sdf_dir,))
+    try:
+        futures = [executor.submit(_load_chunk, chunk, sdf_dir)
+                   for chunk in chunks]
+        for future in as_completed(futures):
+            for path, result in future.result():
+                if isinstance(result, Exception) and not return_exceptions:
+                    raise result
+                yield path, result
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+def _init_worker(sdf_dir):
+    """Compiles all structure definitions of a load_files() worker."""
+    structs = get_structs(sdf_dir)
+    for version in structs:
+        structs[version]
+
+def _load_chunk(paths, sdf_dir):
+    """Decodes a chunk of load_files() paths in a worker process."""
+    result = list()
+    for path in paths:
+        try:
+            result.append((path, File(path, sdf_dir=sdf_dir)))
+        except Exception as e:
+            result.append((path, e))
+    return result
+
+def join_records(rawvals):
+    """
+    Encodes the data strings of raw dossier values into one contiguous
+    buffer. Returns a memoryview of the buffer and the list of (start, end)
+    offsets of the records in it. Slicing the memoryview does not copy.
+    """
+    # ENCODING is a single byte encoding so offsets can be calculated from
+    # the lengths of the strings.
+    bounds = list()
+    start = 0
+    for rawval in rawvals:
+        end = start + len(rawval[1])
+        bounds.append((start, end))
+        start = end
+    buffer = ''.join(rawval[1] for rawval in rawvals).encode(ENCODING)
+    return memoryview(buffer), bounds
+
+def get_frags(data, offset=0, as_arrays=False, use_numpy=True):
+    """
+    Decodes the frag table which starts at offset of data and lasts till
+    its end. Returns a Tanks dictionary of frag counts by tank keys.
+
+    If as_arrays=True it returns the two parallel arrays of tank keys and
+    frag counts instead: numpy arrays if NumPy is available and
+    use_numpy=True, otherwise array.array objects.
+    """
+    count = _numfrags_struct.unpack_from(data, offset)[0]
+    tanks_start = offset + _numfrags_struct.size
+    frags_start = tanks_start + count * _TANKS_SIZE
+    end = frags_start + count * _FRAGS_SIZE
+
+    if len(data) != end:
+        raise sdf.WrongDataLengthError(
+                'Frag table length of {} expected, got {}'
+                .format(end - offset, len(data) - offset)
+            )
+
+    if as_arrays and use_numpy and numpy is not None:
+        tanks = numpy.frombuffer(data, dtype=_numpy_dtype(STRTANKS),
+                                 count=count, offset=tanks_start)
+        frags = numpy.frombuffer(data, dtype=_numpy_dtype(STRFRAGS),
+                                 count=count, offset=frags_start)
+        return tanks, frags
+
+    view = memoryview(data)
+    tanks = _frombytes(STRTANKS, view[tanks_start:frags_start])
+    frags = _frombytes(STRFRAGS, view[frags_start:end])
+
+    if as_arrays:
+        return tanks, frags
+    return Tanks(zip(tanks.tolist(), frags.tolist()))
+
+def _numpy_dtype(char):
+    """Returns the numpy dtype of a frag table format character."""
+    order = sdf.NUMPY_BYTE_ORDERS[STRFORMAT]
+    size = struct.calcsize(STRFORMAT + char)
+    return numpy.dtype('{}{}{}'.format(order, sdf.NUMPY_KINDS[char], size))
+
+def _frombytes(char, data):
+    """
+    Returns an array.array of the frag table format character char filled
+    from data.
+    """
+    size = struct.calcsize(STRFORMAT + char)
+    typecodes = 'bhilq' if char.islower() else 'BHILQ'
+    typecode = [t for t in typecodes if array(t).itemsize == size][0]
+    result = array(typecode)
+    result.frombytes(data)
+    if STRFORMAT in '<>!' and (STRFORMAT == '<') != (
+                                              sys.byteorder == 'little'):
+        result.byteswap()
+    return result
 
 def tankfromwgkey(wargaming_key):
     # The docstring informations are based on Marius (Phalynx) Czyz's
@@ -178,22 +601,166 @@ def _base32name(pure_file_name):
         return base32name.split(';')
 
 
-class Tanks(dict):
+class TitleIndex:
+    """
+    Case-folded index of the titles (or short titles if short=True) of
+    tanks_data. Exact lookups are dictionary lookups, prefix lookups are
+    binary searches and substring lookups intersect the key sets of the
+    n-grams of the searched string.
 
-    def get_by_tit(self, string, short=False, strict=True):
+    Use title_index() to get the shared instances.
+    """
+    GRAM = 3
+
+    def __init__(self, short=False, data=tanks_data):
+        field = 'shorttitle' if short else 'title'
+        self.titles = dict()
+        self.exact = dict()
+        self.grams = dict()
+        folded_titles = list()
+
+        for key, tank in data.items():
+            tit = tank[field]
+            folded = tit.casefold()
+            self.titles[key] = tit
+            self.exact.setdefault(folded, []).append(key)
+            folded_titles.append((folded, key))
+            for gram in self._grams(folded):
+                self.grams.setdefault(gram, set()).add(key)
+
+        folded_titles.sort(key=lambda x: x[0])
+        self.folded = [t[0] for t in folded_titles]
+        self.keys = [t[1] for t in folded_titles]
+
+    def _grams(self, folded):
+        return {folded[i:i+self.GRAM]
+                for i in range(len(folded) - self.GRAM + 1)}
+
+    def find(self, string):
+        """Returns the list of keys of the titles equal to string."""
+        return self.exact.get(string.casefold(), [])
+
+    def prefixed(self, string):
+        """Returns the list of keys of the titles starting with string."""
+        folded = string.casefold()
+        i = bisect_left(self.folded, folded)
         result = list()
-        for tank in self:
-            if short:
-                tit = tanks_data[tank]['shorttitle']
-            else:
-                tit = tanks_data[tank]['title']
+        while i < len(self.folded) and self.folded[i].startswith(folded):
+            result.append(self.keys[i])
+            i += 1
+        return result
 
-            if strict and string.lower() == tit.lower():
-                return self[tank]
-            elif not strict and string.lower() in tit.lower():
-                result.append((tit, self[tank]))
+    def search(self, string):
+        """Returns the set of keys of the titles containing string."""
+        folded = string.casefold()
+        if len(folded) < self.GRAM:
+            return {key for key, tit in zip(self.keys, self.folded)
+                    if folded in tit}
+        grams = sorted(self._grams(folded),
+                       key=lambda g: len(self.grams.get(g, ())))
+        candidates = set(self.grams.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self.grams.get(gram, set())
+        return {key for key in candidates
+                if folded in self.titles[key].casefold()}
+
+_title_indexes = dict()
+
+def title_index(short=False):
+    """Returns the TitleIndex of tanks_data shared by all Tanks."""
+    try:
+        return _title_indexes[short]
+    except KeyError:
+        return _title_indexes.setdefault(short, TitleIndex(short=short))
 
-        return result
+class Tanks(dict):
+
+    def get_by_tit(self, string, short=False, strict=True, prefix=False):
+        """
+        Returns the value of the tank with the title (or short title if
+        short=True) equal to string, or an empty list if there is no
+        such a tank. Comparison is case-insensitive.
+
+        If strict=False it returns the list of (title, value) tuples of
+        all tanks with titles containing string (or starting with string
+        if prefix=True), ordered by title.
+        """
+        index = title_index(short)
+
+        if strict:
+            for tank in index.find(string):
+                if tank in self:
+                    return self[tank]
+            return []
+
+        if prefix:
+            tanks = index.prefixed(string)
+        else:
+            tanks = index.search(string)
+        tanks = sorted((index.titles[tank], tank) for tank in tanks
+                       if tank in self)
+        return [(tit, self[tank]) for tit, tank in tanks]
+
+class LazyTanks(Mapping):
+    """
+    Read-only mapping like Tanks which holds RawTank records of a buffer
+    and decodes each of them on first access. The decoded values are
+    memoized in place of the records. All the ways of reading values go
+    through __getitem__(), so records never get out undecoded;
+    decode_all() decodes all the remaining records, copy() returns them as
+    a Tanks dictionary.
+    """
+    get_by_tit = Tanks.get_by_tit
+
+    def __init__(self, *args, buffer, sdf_dir=SDF_DIR, **kwargs):
+        self._values = dict(*args, **kwargs)
+        self.buffer = buffer
+        self.sdf_dir = sdf_dir
+        self._structs = None
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __repr__(self):
+        return '{}({} tanks)'.format(type(self).__name__, len(self))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_structs'] = None
+        return state
+
+    def __getitem__(self, key):
+        value = self._values[key]
+        if isinstance(value, RawTank):
+            if self._structs is None:
+                self._structs = VersionStructs(get_structs(self.sdf_dir))
+            value = decode_record(self.buffer, value, self._structs)
+            self._values[key] = value
+        return value
+
+    def peek(self, key, default=None):
+        """
+        Returns the value of key as it is stored: decoded or a record.
+        """
+        return self._values.get(key, default)
+
+    def decode_all(self):
+        """Decodes all records which has not been decoded yet."""
+        for key in self:
+            self[key]
+        return self
+
+    def copy(self):
+        """Returns a Tanks dictionary of the decoded values."""
+        return Tanks(self.decode_all()._values)
 
 class TankData(dict):
     def __init__(self, *args, **kwargs):